@@ -0,0 +1,348 @@
+# 부하 테스트: 스텁 캘린더로 서버를 띄우고 N명의 가상 사용자가 WebSocket으로 라운드 전체를 진행한다.
+#
+#   python loadtest.py --users 60 --rounds 5 --output bench.json
+#
+# 턴 전환 지연(p50/p99), 브로드캐스트 팬아웃 시간, 초당 메시지 수, 연결당 메모리를 JSON으로 출력하므로
+# 버전 간 결과를 비교해 broadcast / notify_turn / 커밋 경로의 성능 저하를 확인할 수 있다.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+
+ADMIN_NAME = '건우'
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+def summarize(values_sec):
+    values = [v * 1000 for v in values_sec]
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p99": percentile(values, 99),
+        "mean": statistics.fmean(values) if values else None,
+        "max": max(values) if values else None,
+    }
+
+def read_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+# --- 서버 (하위 프로세스) ---
+def synthetic_names(total_users):
+    with open('names.json', 'r', encoding='utf-8') as f:
+        names = json.load(f)
+    for i in range(max(0, total_users - len(names))):
+        names[f"sim{i:03d}"] = f"S{i}"
+    return names
+
+class StubCalendar:
+    # GCalendar 대신 쓰는 스텁. API 지연만 흉내 내고 항상 성공한다.
+    def __init__(self, latency):
+        self.latency = latency
+        self.service = object()
+        self.credentials = None
+        self.counter = 0
+
+    def has_stored_credentials(self):
+        return False
+
+    def build_service(self, interactive=True):
+        pass
+
+    def seconds_until_expiry(self):
+        return None
+
+    def _event(self, calendar_id, event_name, start, end, description, event_id=None, weeks=1):
+        self.counter += 1
+        event = {
+            'id': event_id or f"stub{self.counter}", 'summary': event_name, 'description': description,
+            'start': {'dateTime': start}, 'end': {'dateTime': end}, 'status': 'confirmed',
+        }
+        if weeks > 1:
+            event['recurrence'] = [f"RRULE:FREQ=WEEKLY;COUNT={weeks}"]
+        return event
+
+    def refresh_credentials(self):
+        pass
+
+    def reload_credentials(self):
+        pass
+
+    def insert_events_batch(self, calendar_id, events):
+        time.sleep(self.latency)
+        return [(self._event(calendar_id, *event), None) for event in events]
+
+    def claim_existing_event(self, calendar_id, event_id, event_name, start, end, description, weeks=1):
+        # 스텁은 409를 내지 않으므로 호출되지 않지만 GCalendar와 같은 인터페이스를 유지한다.
+        time.sleep(self.latency)
+        return self._event(calendar_id, event_name, start, end, description, event_id, weeks)
+
+    def list_events(self, calendar_id, sync_token=None, page_token=None, time_min=None):
+        return {'items': [], 'nextSyncToken': 'stub'}
+
+def serve(args):
+    # 벤치마크가 디스크/캘린더 상태에 영향을 주지 않도록 저널과 미러를 끈다.
+    os.environ["STATE_BACKEND"] = "memory"
+    os.environ["STATE_JOURNAL_DIR"] = ""
+    os.environ["CALENDAR_SYNC_INTERVAL"] = "0"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import uvicorn
+    import main
+    main.name_map.clear()
+    main.name_map.update(synthetic_names(args.users))
+    main.calendar_service = StubCalendar(args.calendar_latency / 1000)
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning", ws_max_queue=1024)
+
+# --- 가상 사용자 ---
+class LoadTest:
+    def __init__(self, args, names):
+        self.args = args
+        self.base = f"127.0.0.1:{args.port}"
+        self.names = names
+        self.connections = {}
+        self.taken: set[str] = set()
+        # 커밋된 슬롯은 캘린더 미러에 남아 다음 라운드에서도 선택할 수 없다.
+        self.booked: set[str] = set()
+        self.turn_user = None
+        self.all_slots = [
+            f"{day}-{time_str}-{floor}"
+            for day in ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+            for time_str in ('AM', 'PM', 'NT') for floor in ('1F', '3F')
+        ]
+        self.messages_received = 0
+        self.turn_latencies = []
+        self.turn_fanouts = []
+        self.chat_fanouts = []
+        self.commit_times = []
+        self.round_times = []
+        # 턴 인덱스 -> 그 턴으로 넘어가게 만든 행동을 보낸 시각
+        self.action_sent_at: dict[int, float] = {}
+        self.turn_seen: dict[int, int] = {}
+        self.acted_index = -1
+        self.round_done = asyncio.Event()
+        # 커밋은 대기열에 넣고 바로 돌아오므로, 캘린더 쓰기 완료(calendar_committed)까지를 잰다.
+        self.commit_done = asyncio.Event()
+        self.pending_chats: dict[str, tuple[float, int]] = {}
+        self.rng = random.Random(args.seed)
+
+    def http(self, method, path):
+        request = urllib.request.Request(f"http://{self.base}{path}", method=method)
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return json.loads(response.read())
+
+    async def connect_all(self):
+        import websockets
+        for name in self.names:
+            ws = await websockets.connect(f"ws://{self.base}/ws/{urllib.parse.quote(name)}", max_queue=None)
+            self.connections[name] = ws
+            asyncio.create_task(self.reader(name, ws))
+
+    async def reader(self, name, ws):
+        try:
+            async for raw in ws:
+                self.messages_received += 1
+                self.on_message(name, json.loads(raw), time.perf_counter())
+        except Exception:
+            pass
+
+    def on_message(self, name, message, now):
+        msg_type = message.get("type")
+        if msg_type == "ping":
+            asyncio.create_task(self.connections[name].send(json.dumps({"type": "pong"})))
+        elif msg_type == "slot_update":
+            self.taken.add(message["slotId"])
+        elif msg_type == "calendar_committed":
+            self.booked.update(message["committed_data"])
+            if name == ADMIN_NAME:
+                self.commit_done.set()
+        elif msg_type == "error" and name == self.turn_user:
+            # 선택이 거절되면 턴이 멈추지 않도록 한 번만 넘긴다.
+            self.turn_user = None
+            asyncio.create_task(self.connections[name].send(json.dumps({"type": "pass_turn"})))
+        elif msg_type == "turn_update":
+            index = message.get("current_index", 0)
+            sent_at = self.action_sent_at.get(index)
+            if sent_at is not None:
+                seen = self.turn_seen[index] = self.turn_seen.get(index, 0) + 1
+                if seen == len(self.connections):
+                    self.turn_fanouts.append(now - sent_at)
+            if message["user"] == "ROUND_END" and name == ADMIN_NAME and message.get("order"):
+                self.round_done.set()
+            if message["user"] == name and index > self.acted_index:
+                if sent_at is not None:
+                    self.turn_latencies.append(now - sent_at)
+                self.acted_index = index
+                self.turn_user = name
+                asyncio.create_task(self.take_turn(name, index))
+        elif msg_type == "chat_message":
+            pending = self.pending_chats.get(message["message"])
+            if pending:
+                sent_at, seen = pending
+                seen += 1
+                if seen == len(self.connections):
+                    self.chat_fanouts.append(now - sent_at)
+                    del self.pending_chats[message["message"]]
+                else:
+                    self.pending_chats[message["message"]] = (sent_at, seen)
+
+    async def take_turn(self, name, index):
+        if self.args.think_ms:
+            await asyncio.sleep(self.args.think_ms / 1000)
+        free = [slot_id for slot_id in self.all_slots if slot_id not in self.taken and slot_id not in self.booked]
+        self.action_sent_at[index + 1] = time.perf_counter()
+        if self.rng.random() < self.args.skip_rate:
+            await self.connections[ADMIN_NAME].send(json.dumps({"type": "admin_skip_turn"}))
+        elif free and self.rng.random() >= self.args.pass_rate:
+            slot_id = self.rng.choice(free)
+            self.taken.add(slot_id)
+            await self.connections[name].send(slot_id)
+        else:
+            await self.connections[name].send(json.dumps({"type": "pass_turn"}))
+
+    async def chatter(self):
+        if self.args.chat_rate <= 0:
+            return
+        counter = 0
+        while True:
+            await asyncio.sleep(1 / self.args.chat_rate)
+            counter += 1
+            text = f"bench-{counter}"
+            self.pending_chats[text] = (time.perf_counter(), 0)
+            sender = self.rng.choice(list(self.connections))
+            await self.connections[sender].send(json.dumps({"type": "chat", "message": text}))
+
+    async def run_round(self):
+        await asyncio.to_thread(self.http, "POST", "/reset_session")
+        self.taken.clear()
+        self.turn_seen = {}
+        self.acted_index = -1
+        self.action_sent_at = {}
+        self.turn_user = None
+        self.round_done.clear()
+        started = time.perf_counter()
+        await asyncio.to_thread(self.http, "POST", "/start_round")
+        await asyncio.wait_for(self.round_done.wait(), timeout=self.args.round_timeout)
+        self.round_times.append(time.perf_counter() - started)
+
+        self.commit_done.clear()
+        started = time.perf_counter()
+        result = await asyncio.to_thread(self.http, "POST", "/commit_calendar")
+        if result.get("status") == "queued":
+            await asyncio.wait_for(self.commit_done.wait(), timeout=self.args.round_timeout)
+        self.commit_times.append(time.perf_counter() - started)
+
+async def drive(args, server_pid):
+    names = [ADMIN_NAME] + [name for name in synthetic_names(args.users) if name != ADMIN_NAME][:args.users - 1]
+    test = LoadTest(args, names)
+    rss_idle = read_rss_kb(server_pid)
+    await test.connect_all()
+    await asyncio.sleep(1)
+    rss_connected = read_rss_kb(server_pid)
+
+    chatter = asyncio.create_task(test.chatter())
+    started = time.perf_counter()
+    received_before = test.messages_received
+    for _ in range(args.rounds):
+        await test.run_round()
+    elapsed = time.perf_counter() - started
+    chatter.cancel()
+    received = test.messages_received - received_before
+
+    for ws in test.connections.values():
+        await ws.close()
+
+    per_connection = None
+    if rss_idle is not None and rss_connected is not None:
+        per_connection = (rss_connected - rss_idle) / len(names)
+    return {
+        "config": {
+            "users": len(names), "rounds": args.rounds, "chat_rate": args.chat_rate,
+            "skip_rate": args.skip_rate, "pass_rate": args.pass_rate, "think_ms": args.think_ms,
+            "calendar_latency_ms": args.calendar_latency, "seed": args.seed,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "turn_advance_ms": summarize(test.turn_latencies),
+        "turn_fanout_ms": summarize(test.turn_fanouts),
+        "chat_fanout_ms": summarize(test.chat_fanouts),
+        "round_duration_ms": summarize(test.round_times),
+        "commit_ms": summarize(test.commit_times),
+        "messages_received": received,
+        "messages_per_sec": received / elapsed if elapsed else None,
+        "server_rss_kb": {"idle": rss_idle, "connected": rss_connected},
+        "memory_per_connection_kb": per_connection,
+    }
+
+def wait_for_server(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("서버 프로세스가 종료되었습니다.")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/get_names", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("서버가 시간 안에 뜨지 않았습니다.")
+
+def main():
+    parser = argparse.ArgumentParser(description="WebSocket 예약 라운드 부하 테스트")
+    parser.add_argument("mode", nargs="?", default="run", choices=["run", "serve"])
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--chat-rate", type=float, default=5, help="초당 채팅 메시지 수")
+    parser.add_argument("--skip-rate", type=float, default=0.05, help="관리자가 턴을 스킵할 확률")
+    parser.add_argument("--pass-rate", type=float, default=0.1, help="사용자가 턴을 넘길 확률")
+    parser.add_argument("--think-ms", type=float, default=0, help="턴을 받은 뒤 행동까지 대기 시간")
+    parser.add_argument("--calendar-latency", type=float, default=50, help="스텁 캘린더 API 지연(ms)")
+    parser.add_argument("--round-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="결과 JSON 파일 (기본: 표준 출력)")
+    args = parser.parse_args()
+
+    if args.mode == "serve":
+        serve(args)
+        return
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--users", str(args.users), "--port", str(args.port),
+         "--calendar-latency", str(args.calendar_latency)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(args.port, server)
+        result = asyncio.run(drive(args, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
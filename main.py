@@ -1,20 +1,204 @@
 import uvicorn
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request as HTTPRequest
+from fastapi.responses import PlainTextResponse, Response
+from pydantic import BaseModel, ValidationError
+import msgpack
+import csv
 import json
 import random
 import datetime
 import os
+import asyncio
+import atexit
+import base64
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import gzip
+import hashlib
+import io
+import logging
+import logging.handlers
+import queue
+import re
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+import types
 from typing import Any
-import google.auth
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 
 app = FastAPI()
 
+# --- 로깅 ---
+# 로그 레벨 (DEBUG이면 턴 알림 전체 payload도 남긴다)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# text 또는 json (한 줄에 하나의 JSON 객체)
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "pid": record.process,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging():
+    # 이벤트 루프에서는 레코드를 큐에 넣기만 하고, 실제 출력(I/O)은 QueueListener 스레드가 한다.
+    handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(message)s"))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    scheduler_logger = logging.getLogger("scheduler")
+    scheduler_logger.setLevel(LOG_LEVEL)
+    scheduler_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    scheduler_logger.propagate = False
+    return scheduler_logger
+
+logger = setup_logging()
+
+@contextlib.contextmanager
+def quiet_logs(below=logging.WARNING):
+    # 이 스레드에서 나오는 below 미만의 로그를 잠시 버린다 (저널 재적용처럼 이미 한 번 기록된 일을 다시 할 때).
+    thread_id = threading.get_ident()
+    log_filter = lambda record: record.thread != thread_id or record.levelno >= below
+    logger.addFilter(log_filter)
+    try:
+        yield
+    finally:
+        logger.removeFilter(log_filter)
+
+# --- 메트릭 ---
+# /metrics에서 Prometheus 텍스트 형식으로 내보낸다. 값은 워커(프로세스)별이며 모두 이벤트 루프에서만 갱신한다.
+METRICS: list["Metric"] = []
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        METRICS.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(label, "")) for label in self.label_names)
+
+    def _labels(self, key: tuple[str, ...], extra: str = "") -> str:
+        parts = [f'{label}="{value}"' for label, value in zip(self.label_names, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+    def samples(self) -> list[str]:
+        return []
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [f"{self.name}{self._labels(key)} {value}" for key, value in self.values.items()]
+
+class Gauge(Metric):
+    # 값을 저장하지 않고 수집 시점에 함수를 호출해 읽는다.
+    kind = "gauge"
+
+    def __init__(self, name, help_text, read):
+        super().__init__(name, help_text)
+        self.read = read
+
+    def samples(self):
+        return [f"{self.name} {self.read()}"]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+        # key -> [버킷별 개수..., +Inf 개수], 합계
+        self.counts: dict[tuple[str, ...], list[int]] = {}
+        self.sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self.counts.get(key)
+        if counts is None:
+            counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            self.sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[key] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        lines = []
+        for key, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_label = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self._labels(key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {self.sums[key]}")
+            lines.append(f"{self.name}_count{self._labels(key)} {cumulative}")
+        return lines
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+WS_MESSAGE_SECONDS = Histogram(
+    "scheduler_ws_message_seconds", "WebSocket 메시지 처리 시간 (타입별)", ("type",))
+WS_MESSAGE_ERRORS = Counter(
+    "scheduler_ws_message_errors_total", "거절된 WebSocket 메시지 수 (타입별)", ("type",))
+BROADCAST_SECONDS = Histogram(
+    "scheduler_broadcast_seconds", "이 워커의 접속자 송신 큐에 메시지를 넣는 데 걸린 시간")
+BROADCAST_FAILURES = Counter(
+    "scheduler_broadcast_failures_total", "전송 실패/느린 클라이언트로 끊은 연결 수", ("reason",))
+CALENDAR_REQUEST_SECONDS = Histogram(
+    "scheduler_calendar_request_seconds", "Calendar API 삽입 요청 시간", ("op",))
+CALENDAR_EVENTS = Counter(
+    "scheduler_calendar_events_total", "Calendar API 이벤트 삽입 결과", ("op", "result"))
+COMMAND_SECONDS = Histogram(
+    "scheduler_command_seconds", "상태 변경 명령 적용 시간 (명령별)", ("command",))
+COMMAND_BATCH_SIZES = Histogram(
+    "scheduler_command_batch_size", "writer task가 한 번에 적용한 명령 수", (),
+    (1, 2, 4, 8, 16, 32, 64, 128, 256))
+ROUND_DURATION_SECONDS = Histogram(
+    "scheduler_round_duration_seconds", "라운드 시작부터 종료까지 걸린 시간", (),
+    (10, 30, 60, 120, 300, 600, 1200, 1800, 3600))
+
 # --- Google Calendar 설정 ---
 CLIENT_SECRET = 'client_secret.json'
 SCOPES = ['https://www.googleapis.com/auth/calendar']
@@ -22,6 +206,37 @@ CALENDAR_IDS = {
     '1F': 'q2ipgq5e47l7d9g24ibbq08avo@group.calendar.google.com',
     '3F': 'cmhg0lmmdk66tmd9nc6ug7fob0@group.calendar.google.com'
 }
+# Calendar API 배치 요청 하나에 담을 최대 이벤트 수 (API 한도 50)
+CALENDAR_BATCH_SIZE = 50
+# 동시에 진행할 배치 요청 수 (층/캘린더 단위로 병렬 처리)
+COMMIT_CONCURRENCY = int(os.environ.get("COMMIT_CONCURRENCY", "2"))
+# 일시적인 실패(네트워크, 5xx, 요청 한도)로 다시 보낼 때의 대기 시간(초). 실패할 때마다 두 배, 최대 CALENDAR_RETRY_MAX.
+CALENDAR_RETRY_BASE = float(os.environ.get("CALENDAR_RETRY_BASE", "1"))
+CALENDAR_RETRY_MAX = float(os.environ.get("CALENDAR_RETRY_MAX", "300"))
+# 한 라운드가 한 번에 예약할 수 있는 최대 주 수. 여러 주 예약은 매주 반복 일정(RRULE) 하나로 쓴다.
+BOOKING_MAX_WEEKS = int(os.environ.get("BOOKING_MAX_WEEKS", "26"))
+# /admin/bulk_add 한 번에 받을 수 있는 최대 행 수
+BULK_IMPORT_MAX_ROWS = int(os.environ.get("BULK_IMPORT_MAX_ROWS", "2000"))
+# 액세스 토큰 만료 몇 초 전에 백그라운드에서 미리 갱신할지
+CALENDAR_TOKEN_REFRESH_MARGIN = float(os.environ.get("CALENDAR_TOKEN_REFRESH_MARGIN", "300"))
+# 캘린더 미러를 syncToken으로 갱신하는 주기(초). 0이면 미러를 쓰지 않는다.
+CALENDAR_SYNC_INTERVAL = float(os.environ.get("CALENDAR_SYNC_INTERVAL", "60"))
+
+@functools.cache
+def google_client():
+    # Google 클라이언트 라이브러리는 불러오는 데만 수백 ms가 걸리므로, 모듈 로드 때가 아니라 처음 쓸 때 불러온다.
+    # 서버가 뜬 뒤에는 run_token_refresher가 워커 스레드에서 미리 불러 둔다.
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+    from google_auth_httplib2 import AuthorizedHttp
+    import httplib2
+    return types.SimpleNamespace(
+        Request=Request, Credentials=Credentials, InstalledAppFlow=InstalledAppFlow, build=build,
+        HttpError=HttpError, AuthorizedHttp=AuthorizedHttp, httplib2=httplib2,
+    )
 
 class GCalendar:
     KST = datetime.timezone(datetime.timedelta(hours=9))
@@ -31,198 +246,2102 @@ class GCalendar:
         self.credentials = None
         self.service = None
 
-    def build_service(self):
+    def has_stored_credentials(self):
+        return bool(os.environ.get('CALENDAR_STORAGE_JSON')) or os.path.exists(self.storage_name)
+
+    def build_service(self, interactive=True):
+        google = google_client()
         storage_content = os.environ.get('CALENDAR_STORAGE_JSON')
         if storage_content:
-            print("환경 변수에서 Google Credential 로드 시도...")
+            logger.info("환경 변수에서 Google Credential 로드 시도...")
             try:
                 creds_info = json.loads(storage_content)
-                self.credentials = Credentials.from_authorized_user_info(creds_info, SCOPES)
+                self.credentials = google.Credentials.from_authorized_user_info(creds_info, SCOPES)
             except Exception as e:
-                print(f"환경 변수 로드 실패: {e}")
+                logger.error("환경 변수 로드 실패: %s", e)
                 self.credentials = None
         else:
-            print("환경 변수 없음. 로컬 파일(Calendar.storage)로 인증 시도...")
+            logger.info("환경 변수 없음. 로컬 파일(Calendar.storage)로 인증 시도...")
             if os.path.exists(self.storage_name):
-                self.credentials = Credentials.from_authorized_user_file(self.storage_name, SCOPES)
+                self.credentials = google.Credentials.from_authorized_user_file(self.storage_name, SCOPES)
             else:
                 self.credentials = None
 
         if not self.credentials or not self.credentials.valid:
             if self.credentials and self.credentials.expired and self.credentials.refresh_token:
-                print("토큰 만료. 리프레시 시도...")
+                logger.info("토큰 만료. 리프레시 시도...")
                 try:
-                    self.credentials.refresh(Request())
-                    if os.path.exists(self.storage_name):
-                        with open(self.storage_name, 'w') as token:
-                            token.write(self.credentials.to_json())
+                    self.refresh_credentials()
                 except Exception as e:
-                    print(f"토큰 리프레시 실패: {e}. 로컬 인증이 필요할 수 있습니다.")
+                    logger.warning("토큰 리프레시 실패: %s. 로컬 인증이 필요할 수 있습니다.", e)
                     self.credentials = None
             
+            if not self.credentials and not interactive:
+                raise Exception("Google Auth Error. (저장된 Credential 없음)")
             if not self.credentials:
-                print("유효한 Google Credential이 없습니다. 로컬 인증 흐름(InstalledAppFlow)을 시작합니다.")
+                logger.warning("유효한 Google Credential이 없습니다. 로컬 인증 흐름(InstalledAppFlow)을 시작합니다.")
                 try:
-                    flow = InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET, SCOPES)
+                    flow = google.InstalledAppFlow.from_client_secrets_file(CLIENT_SECRET, SCOPES)
                     self.credentials = flow.run_local_server(port=0)
                     with open(self.storage_name, 'w') as token:
                         token.write(self.credentials.to_json())
-                    print("로컬 인증 성공. Calendar.storage 파일 생성됨.")
+                    logger.info("로컬 인증 성공. Calendar.storage 파일 생성됨.")
                 except Exception as e:
-                    print(f"로컬 인증 흐름 실패: {e}")
+                    logger.error("로컬 인증 흐름 실패: %s", e)
                     raise Exception("Google Auth Error.")
         
-        print("Google Credential 로드 성공.")
-        self.service = build('calendar', 'v3', credentials=self.credentials)
+        logger.info("Google Credential 로드 성공.")
+        # 요청마다 현재 credentials로 만든 http를 넘기므로, 서비스 객체는 프로세스당 한 번만 만든다.
+        if self.service is None:
+            self.service = google.build('calendar', 'v3', credentials=self.credentials)
+
+    def refresh_credentials(self):
+        self.credentials.refresh(google_client().Request())
+        self.save_credentials()
+
+    def reload_credentials(self):
+        # 401/403을 받은 뒤: 저장된 Credential을 다시 읽고 토큰을 새로 받는다.
+        self.build_service(interactive=False)
+        if self.credentials.refresh_token:
+            self.refresh_credentials()
+
+    def save_credentials(self):
+        # 로컬 파일로 인증한 경우에만 갱신된 토큰을 다시 쓴다. 쓰는 도중 죽어도 파일이 깨지지 않도록 교체한다.
+        if os.path.exists(self.storage_name):
+            tmp_name = self.storage_name + '.tmp'
+            with open(tmp_name, 'w') as token:
+                token.write(self.credentials.to_json())
+            os.replace(tmp_name, self.storage_name)
+
+    def seconds_until_expiry(self):
+        if not self.credentials or not self.credentials.expiry:
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return (self.credentials.expiry - now).total_seconds()
+
+    def _authorized_http(self):
+        # httplib2.Http는 스레드 안전하지 않으므로 워커 스레드에서 실행하는 요청마다 새로 만든다.
+        google = google_client()
+        return google.AuthorizedHttp(self.credentials, http=google.httplib2.Http())
 
-    def insert_event(self, calendar_id, event_name, start, end, description):
+    @staticmethod
+    def _event_body(event_name, start, end, description, event_id=None, weeks=1):
+        body = {
+            'summary': event_name, 'description': description,
+            'start': {'dateTime': start, 'timeZone': 'Asia/Seoul'},
+            'end': {'dateTime': end, 'timeZone': 'Asia/Seoul'},
+        }
+        if event_id:
+            body['id'] = event_id
+        if weeks > 1:
+            body['recurrence'] = [f"RRULE:FREQ=WEEKLY;COUNT={weeks}"]
+        return body
+
+    @staticmethod
+    def event_id(calendar_id, week_start, slot_id, weeks=1):
+        # 같은 주의 같은 슬롯은 항상 같은 이벤트 ID가 되므로, 다시 보내도 일정이 두 번 생기지 않는다 (409).
+        # Calendar 이벤트 ID는 base32hex 소문자(0-9, a-v)만 허용한다.
+        key = f"{calendar_id}|{week_start}|{slot_id}" + (f"|{weeks}" if weeks > 1 else "")
+        digest = hashlib.sha1(key.encode()).digest()
+        return base64.b32hexencode(digest).decode().lower().rstrip('=')
+
+    @staticmethod
+    def is_conflict(error):
+        # 같은 ID의 일정이 이미 있음 (409)
+        return isinstance(error, google_client().HttpError) and error.resp.status == 409
+
+    @staticmethod
+    def is_auth_error(error):
+        # 토큰 만료/취소(401)나 권한 문제(호출 한도 초과가 아닌 403). Credential을 다시 읽은 뒤 다시 보낸다.
+        if not isinstance(error, google_client().HttpError):
+            return False
+        status = error.resp.status
+        return status == 401 or (status == 403 and b'ratelimitexceeded' not in (error.content or b'').lower())
+
+    def list_events(self, calendar_id, sync_token=None, page_token=None, time_min=None):
+        # sync_token이 있으면 그 이후 변경분(삭제 포함)만 돌려준다. 만료된 토큰이면 HttpError 410.
+        params = {'calendarId': calendar_id, 'singleEvents': True, 'maxResults': 2500}
+        if sync_token:
+            params['syncToken'] = sync_token
+        elif time_min:
+            params['timeMin'] = time_min
+        if page_token:
+            params['pageToken'] = page_token
+        return self.service.events().list(**params).execute(http=self._authorized_http())
+
+    def insert_events_batch(self, calendar_id, events):
+        # events: [(event_name, start, end, description, event_id, weeks), ...]
+        # 하나의 배치 요청(HTTP 1회)으로 보내고, 입력과 같은 순서로 (응답, 예외) 목록을 돌려준다.
+        results = [(None, None)] * len(events)
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                logger.error("An error occurred while inserting the event (%s): %s", events[int(request_id)][3], exception)
+            results[int(request_id)] = (response, exception)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for i, (event_name, start, end, description, event_id, weeks) in enumerate(events):
+            body = self._event_body(event_name, start, end, description, event_id, weeks)
+            batch.add(self.service.events().insert(calendarId=calendar_id, body=body), request_id=str(i))
         try:
-            body = {
-                'summary': event_name, 'description': description,
-                'start': {'dateTime': start, 'timeZone': 'Asia/Seoul'},
-                'end': {'dateTime': end, 'timeZone': 'Asia/Seoul'},
-            }
-            return self.service.events().insert(calendarId=calendar_id, body=body).execute()
+            batch.execute(http=self._authorized_http())
         except Exception as e:
-            print(f"An error occurred while inserting the event: {e}")
-            return None
+            logger.error("An error occurred while executing the batch request: %s", e)
+            return [(None, e)] * len(events)
+        return results
+
+    def claim_existing_event(self, calendar_id, event_id, event_name, start, end, description, weeks=1):
+        # 같은 ID의 일정이 이미 있을 때(409). 이전 시도에서 들어간 같은 사람의 일정이면 그대로 쓰고,
+        # 삭제(취소)된 일정이면 다시 살린다. 다른 사람의 일정이면 None.
+        http = self._authorized_http()
+        existing = self.service.events().get(calendarId=calendar_id, eventId=event_id).execute(http=http)
+        if existing.get('status') != 'cancelled':
+            return existing if existing.get('summary') == event_name else None
+        body = self._event_body(event_name, start, end, description, weeks=weeks)
+        body['status'] = 'confirmed'
+        return self.service.events().update(calendarId=calendar_id, eventId=event_id, body=body).execute(http=http)
 
 calendar_service = GCalendar("Calendar.storage")
 
+calendar_build_lock = asyncio.Lock()
+
+async def ensure_calendar_service(interactive=True):
+    # 서비스는 처음 한 번만 만들고, 토큰은 run_token_refresher가 만료 전에 갱신해 둔다.
+    # 갱신이 늦어 이미 만료된 경우에만 요청 경로에서 직접 갱신한다.
+    async with calendar_build_lock:
+        if not calendar_service.service:
+            await asyncio.to_thread(calendar_service.build_service, interactive)
+        elif calendar_service.credentials and not calendar_service.credentials.valid:
+            logger.info("토큰 만료. 리프레시 시도...")
+            await asyncio.to_thread(calendar_service.refresh_credentials)
+
+async def reload_calendar_credentials():
+    # 캘린더 쓰기가 인증 오류로 실패했을 때. 해당 슬롯은 대기로 남아 백오프 후 다시 보낸다.
+    async with calendar_build_lock:
+        try:
+            await asyncio.to_thread(calendar_service.reload_credentials)
+            logger.info("Google Credential을 다시 읽었습니다.")
+        except Exception as e:
+            logger.warning("Google Credential 다시 읽기 실패: %s", e)
+
+async def run_token_refresher():
+    # 서버가 요청을 받기 시작한 뒤 Google 클라이언트를 워커 스레드에서 미리 불러 둔다.
+    try:
+        await asyncio.to_thread(google_client)
+    except Exception as e:
+        logger.warning("Google 클라이언트 라이브러리를 불러오지 못했습니다: %s", e)
+    while True:
+        delay = 60
+        try:
+            if not calendar_service.service and calendar_service.has_stored_credentials():
+                await ensure_calendar_service(interactive=False)
+            remaining = calendar_service.seconds_until_expiry()
+            if remaining is not None and calendar_service.credentials.refresh_token:
+                if remaining <= CALENDAR_TOKEN_REFRESH_MARGIN:
+                    async with calendar_build_lock:
+                        await asyncio.to_thread(calendar_service.refresh_credentials)
+                    logger.info("Google 액세스 토큰 사전 갱신 완료.")
+                    continue
+                delay = min(remaining - CALENDAR_TOKEN_REFRESH_MARGIN, 600)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Google 액세스 토큰 사전 갱신 실패: %s", e)
+        await asyncio.sleep(delay)
+
+token_refresher_task = None
+
+@app.on_event("startup")
+async def start_token_refresher():
+    # 저장된 Credential이 있으면 서버가 뜬 직후 서비스를 미리 만들어, 첫 커밋이 인증/디스커버리 비용을 치르지 않게 한다.
+    global token_refresher_task
+    token_refresher_task = asyncio.create_task(run_token_refresher())
+
+@app.on_event("shutdown")
+async def stop_token_refresher():
+    if token_refresher_task:
+        token_refresher_task.cancel()
+
+# --- 슬롯 모델 ---
+# 슬롯 ID는 "Day-Time-Floor" 문자열이지만, 내부에서는 (요일 × 시간대 × 층) 고정 격자의 정수 인덱스로 다룬다.
+# 문자열 파싱 없이 표 조회만으로 검증하고, 점유 여부는 슬롯 인덱스를 비트 위치로 하는 정수 비트마스크로 계산한다.
+SLOT_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+SLOT_TIMES = ('AM', 'PM', 'NT')
+SLOT_TIME_RANGES = {'AM': (8, 0, 13, 0), 'PM': (13, 0, 19, 0), 'NT': (19, 0, 24, 0)}
+SLOT_START_HOURS = {start_hour: time_str for time_str, (start_hour, _, _, _) in SLOT_TIME_RANGES.items()}
+SLOT_FLOORS = tuple(CALENDAR_IDS)
+SLOT_IDS = tuple(f"{day}-{time_str}-{floor}" for day in SLOT_DAYS for time_str in SLOT_TIMES for floor in SLOT_FLOORS)
+SLOT_INDEX = {slot_id: i for i, slot_id in enumerate(SLOT_IDS)}
+# 슬롯 인덱스 -> (요일 번호, 시간대, 층)
+SLOT_PARTS = tuple(
+    (day_num, time_str, floor) for day_num in range(len(SLOT_DAYS)) for time_str in SLOT_TIMES for floor in SLOT_FLOORS
+)
+ALL_SLOTS_MASK = (1 << len(SLOT_IDS)) - 1
+FLOOR_MASKS = {
+    floor: sum(1 << i for i, (_, _, slot_floor) in enumerate(SLOT_PARTS) if slot_floor == floor) for floor in SLOT_FLOORS
+}
+
+def slot_ids_in_mask(mask: int):
+    return [SLOT_IDS[i] for i in range(len(SLOT_IDS)) if mask >> i & 1]
+
+class SlotTimeTable:
+    # 주(월요일 날짜)별로 모든 (요일, 시간대)의 ISO 시작/종료 시각을 한 번에 계산해 둔다.
+    def __init__(self):
+        self.tables: dict[datetime.date, dict[tuple[int, str], tuple[str, str]]] = {}
+
+    def _build(self, week_start):
+        table = {}
+        for day_num in range(len(SLOT_DAYS)):
+            event_date = week_start + datetime.timedelta(days=day_num)
+            for time_str, (start_hour, start_minute, end_hour, end_minute) in SLOT_TIME_RANGES.items():
+                start_time = datetime.datetime.combine(event_date, datetime.time(start_hour, start_minute, tzinfo=GCalendar.KST))
+                if end_hour == 24:
+                    end_time = datetime.datetime.combine(event_date + datetime.timedelta(days=1), datetime.time(0, 0, tzinfo=GCalendar.KST))
+                else:
+                    end_time = datetime.datetime.combine(event_date, datetime.time(end_hour, end_minute, tzinfo=GCalendar.KST))
+                table[(day_num, time_str)] = (start_time.isoformat(), end_time.isoformat())
+        return table
+
+    def for_week(self, week_start: datetime.date):
+        table = self.tables.get(week_start)
+        if table is None:
+            if len(self.tables) > 16:
+                self.tables = {}
+            table = self.tables[week_start] = self._build(week_start)
+        return table
+
+slot_time_table = SlotTimeTable()
+
 # --- 사용자 및 상태 관리 ---
 try:
     with open('names.json', 'r', encoding='utf-8') as f:
         name_map = json.load(f)
-    print(f"names.json 로드 성공. {len(name_map)}명.")
+    logger.info("names.json 로드 성공. %d명.", len(name_map))
 except FileNotFoundError:
-    print("[에러] names.json 파일을 찾을 수 없습니다!")
+    logger.error("names.json 파일을 찾을 수 없습니다!")
     name_map = {"건우": "KW"}
+# 기본 방의 관리자
+ADMIN_NAME = '건우'
+
+# --- WebSocket 송신 설정 ---
+# 연결별 송신 큐에 쌓일 수 있는 최대 프레임 수. 넘으면 느린 클라이언트로 보고 연결을 끊는다.
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "256"))
+# 프레임 하나를 보내는 데 허용하는 최대 시간(초). 넘으면 느린 클라이언트로 보고 연결을 끊는다.
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "5"))
+# 아직 전송되지 않은 이전 프레임을 최신 프레임으로 대체(coalesce)할 메시지 타입. 빈 값이면 모두 전송.
+WS_COALESCE_TYPES = frozenset(
+    t.strip() for t in os.environ.get("WS_COALESCE_TYPES", "turn_update,initial_state,commit_progress").split(",") if t.strip()
+)
+
+# 서버가 ping을 보내는 주기(초). 클라이언트는 pong으로 답한다. 0이면 보내지 않는다.
+WS_PING_INTERVAL = float(os.environ.get("WS_PING_INTERVAL", "20"))
+# 이 시간(초) 동안 클라이언트에게서 아무 메시지(pong 포함)도 오지 않으면 끊긴 연결로 보고 정리한다.
+WS_IDLE_TIMEOUT = float(os.environ.get("WS_IDLE_TIMEOUT", "60"))
+
+# 클라이언트가 이 서브프로토콜을 요청하면 서버→클라이언트 프레임을 JSON 대신 바이너리(msgpack)로 보낸다.
+WS_BINARY_SUBPROTOCOL = "scheduler.msgpack"
+
+# --- 메시지 인코딩 ---
+# orjson이 설치되어 있으면 쓰고, 없으면 표준 json을 쓴다.
+try:
+    import orjson
+
+    def encode_json(payload) -> str:
+        return orjson.dumps(payload).decode()
+except ImportError:
+    def encode_json(payload) -> str:
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+def pack_msgpack(payload) -> bytes:
+    return msgpack.packb(payload)
+
+# 바이너리 프레임에서 슬롯 ID를 SLOT_INDEX 번호로 줄여 보내는 필드
+SLOT_KEY_FIELDS = ("reserved", "pending", "committed_data")
+SLOT_LIST_FIELDS = ("removed",)
+
+def encode_binary_payload(payload: dict) -> bytes:
+    payload = dict(payload)
+    for field in SLOT_KEY_FIELDS:
+        if field in payload:
+            payload[field] = {SLOT_INDEX.get(slot_id, slot_id): value for slot_id, value in payload[field].items()}
+    for field in SLOT_LIST_FIELDS:
+        if field in payload:
+            payload[field] = [SLOT_INDEX.get(slot_id, slot_id) for slot_id in payload[field]]
+    if "slotId" in payload:
+        payload["slotId"] = SLOT_INDEX.get(payload["slotId"], payload["slotId"])
+    if payload.get("type") == "initial_state":
+        # 번호 -> 슬롯 ID 표. 클라이언트는 이후 프레임을 이 표로 되돌린다.
+        payload["slots"] = SLOT_IDS
+    return pack_msgpack(payload)
+
+def encode_binary(message: str) -> bytes:
+    return encode_binary_payload(json.loads(message))
+
+# 기다리지 않고 띄우는 task. 이벤트 루프는 task를 약하게만 잡고 있어서 참조를 남기지 않으면
+# 실행되기 전에 GC될 수 있으므로, 끝날 때까지 여기에 둔다.
+background_tasks: set[asyncio.Task] = set()
+
+def spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+class ClientChannel:
+    # 연결마다 하나씩 두는 송신 큐 + writer task.
+    # broadcast는 큐에 넣기만 하므로(O(1)) 느린 클라이언트가 다른 클라이언트의 전송을 막지 않는다.
+    def __init__(self, websocket: WebSocket, user_name: str, room: "Room", binary: bool = False):
+        self.ws = websocket
+        self.user_name = user_name
+        self.room = room
+        self.binary = binary
+        self.conn_id = secrets.token_hex(4)
+        self.queue: collections.deque[tuple[int, str | None, str | bytes]] = collections.deque()
+        self.latest: dict[str, int] = {}
+        self.seq = 0
+        self.closed = False
+        # 클라이언트에게서 마지막으로 메시지를 받은 시각 (하트비트)
+        self.last_seen = time.monotonic()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._writer())
+
+    def send(self, message: str | bytes, msg_type: str | None = None) -> bool:
+        if self.closed:
+            return False
+        if self.binary and isinstance(message, str):
+            message = encode_binary(message)
+        if len(self.queue) >= WS_SEND_QUEUE_SIZE:
+            BROADCAST_FAILURES.inc(reason="queue_full")
+            self.evict(f"송신 큐 초과 ({len(self.queue)})")
+            return False
+        self.seq += 1
+        if msg_type in WS_COALESCE_TYPES:
+            self.latest[msg_type] = self.seq
+        self.queue.append((self.seq, msg_type, message))
+        self.wakeup.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                seq, msg_type, message = self.queue.popleft()
+                # 같은 타입의 더 최신 프레임이 큐에 있으면 이 프레임은 건너뛴다.
+                if msg_type in WS_COALESCE_TYPES and self.latest.get(msg_type) != seq:
+                    continue
+                try:
+                    if isinstance(message, bytes):
+                        await asyncio.wait_for(self.ws.send_bytes(message), WS_SEND_TIMEOUT)
+                    else:
+                        await asyncio.wait_for(self.ws.send_text(message), WS_SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    BROADCAST_FAILURES.inc(reason="timeout")
+                    self.evict(f"전송 시간 초과 ({WS_SEND_TIMEOUT}s)")
+                except Exception as e:
+                    BROADCAST_FAILURES.inc(reason="error")
+                    self.evict(f"브로드캐스트 실패: {e}")
+        except asyncio.CancelledError:
+            pass
+
+    def evict(self, reason: str, code: int = 1013, close_reason: str = "Slow consumer"):
+        if self.closed:
+            return
+        logger.warning("클라이언트 '%s' 연결 해제: %s", self.user_name, reason)
+        self.closed = True
+        self.queue.clear()
+        self.wakeup.set()
+        # 더 이상 브로드캐스트 대상이 아니도록 즉시 제외하고, 소켓 종료는 별도 task로 처리한다.
+        user_data = self.room.connections.get(self.user_name)
+        if user_data and user_data.get("channel") is self:
+            del self.room.connections[self.user_name]
+            spawn(run_command(self.room, "disconnect", user_name=self.user_name, conn=self.conn_id))
+        spawn(self._close(code, close_reason))
+
+    def replace(self):
+        # 같은 사용자가 세션 토큰으로 다시 접속해 이 연결을 대체했다. 접속 상태(presence)는 새 연결이 이어받는다.
+        self.stop()
+        spawn(self._close(4000, "Session resumed"))
+
+    async def _close(self, code: int, reason: str):
+        try:
+            await self.ws.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.closed = True
+        self.queue.clear()
+        self.task.cancel()
+
+# --- 상태 저장소 설정 ---
+# memory: 단일 프로세스용 (기본값), sqlite: 여러 uvicorn 워커가 STATE_DB_PATH 파일 하나를 공유
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "scheduler_state.db")
+# 보드(예약/대기 슬롯)를 바꾸는 변경은 버전 번호가 붙은 작은 메시지로 브로드캐스트되고,
+# 최근 STATE_LOG_SIZE개는 로그에 남아 뒤처지거나 재접속한 클라이언트에게 그대로 다시 보낸다.
+STATE_LOG_SIZE = int(os.environ.get("STATE_LOG_SIZE", "512"))
+# sqlite 백엔드에서 다른 워커의 브로드캐스트를 가져오는 주기(초)
+BUS_POLL_INTERVAL = float(os.environ.get("BUS_POLL_INTERVAL", "0.02"))
+# 이 시간(초) 동안 하트비트가 없는 워커는 죽은 것으로 보고 그 워커의 접속자를 정리한다.
+WORKER_TIMEOUT = float(os.environ.get("WORKER_TIMEOUT", "10"))
+WORKER_ID = secrets.token_hex(4)
+# memory 백엔드의 스냅샷/저널 디렉터리. 빈 값이면 재시작 시 상태를 복구하지 않는다.
+STATE_JOURNAL_DIR = os.environ.get("STATE_JOURNAL_DIR", "state_journal")
+# 저널 fsync 주기(초). 0이면 기록할 때마다 fsync, 그 외에는 백그라운드에서 모아서 fsync한다.
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("JOURNAL_FSYNC_INTERVAL", "0.2"))
+# 저널이 이만큼 쌓이면 스냅샷을 새로 쓰고 저널을 비운다.
+JOURNAL_COMPACT_EVERY = int(os.environ.get("JOURNAL_COMPACT_EVERY", "500"))
+
+class SchedulerState:
+    # 스케줄링 상태 전체. 저장소 구현과 무관하게 명령(command) 함수는 이 객체만 다룬다.
+    FIELDS = (
+        "epoch", "version", "turn_order", "current_turn_index", "week_mode",
+        "confirmed_reserved_slots", "current_round_selections", "presence",
+        "round_mode", "turn_timeout", "preferences", "calendar_outbox", "week_count", "sessions",
+    )
+
+    def __init__(self):
+        # 상태가 새로 만들어지면 버전이 0부터 다시 시작하므로, 클라이언트가 이를 알아챌 수 있도록 epoch를 둔다.
+        self.epoch = secrets.token_hex(4)
+        self.version = 0
+        self.turn_order: list[str] = []
+        self.current_turn_index = 0
+        self.week_mode = 1
+        # week_mode의 주부터 몇 주를 예약하는지. 2 이상이면 매주 반복 일정으로 커밋한다.
+        self.week_count = 1
+        self.confirmed_reserved_slots: dict[str, str] = {}
+        self.current_round_selections: dict[str, str] = {}
+        # 캘린더에 아직 쓰지 못한 예약: slot_id -> {"user", "initial", "week_start", "weeks"}.
+        # 쓰기가 끝날 때까지 슬롯은 current_round_selections에 남아 보드에 대기(pending)로 보인다.
+        self.calendar_outbox: dict[str, dict[str, str]] = {}
+        # turns: turn_order 순서대로 한 명씩 선택, preferences: 모두가 선호 목록을 낸 뒤 한 번에 배정
+        self.round_mode = "turns"
+        # 턴(선호 목록 모드에서는 제출 기간)의 제한 시간(초). 0이면 제한 없음.
+        self.turn_timeout = 0.0
+        # 선호 목록 모드에서 사용자 -> 순위대로 정렬된 슬롯 ID 목록
+        self.preferences: dict[str, list[str]] = {}
+        # 접속 중인 사용자 -> {"participating", "worker", "conn"}. 모든 워커의 접속자를 합친 목록.
+        self.presence: dict[str, dict[str, Any]] = {}
+        # 사용자 -> {"token", "participating"}. 연결이 끊겼다가 토큰을 들고 돌아오면 같은 세션을 이어받는다.
+        self.sessions: dict[str, dict[str, Any]] = {}
+        # 명령 실행 중 쌓이는 브로드캐스트: (message, msg_type, version)
+        self.outbox: list[tuple[str, str | None, int | None]] = []
+
+        # 확정/대기 슬롯의 점유 비트마스크. 위 두 dict에서 파생되며 저장하지 않는다.
+        self.occupied = 0
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        for field in cls.FIELDS:
+            if field in data:
+                setattr(state, field, data[field])
+        for slot_id in (*state.confirmed_reserved_slots, *state.current_round_selections):
+            if slot_id in SLOT_INDEX:
+                state.occupied |= 1 << SLOT_INDEX[slot_id]
+        return state
+
+    # 슬롯 dict는 아래 메서드로만 바꿔서 점유 비트마스크와 항상 맞춘다.
+    def is_occupied(self, slot_id: str):
+        return bool(self.occupied >> SLOT_INDEX[slot_id] & 1)
+
+    def set_pending(self, slot_id: str, user_name: str):
+        self.current_round_selections[slot_id] = user_name
+        self.occupied |= 1 << SLOT_INDEX[slot_id]
+
+    def set_reserved(self, slot_id: str, initial: str):
+        self.current_round_selections.pop(slot_id, None)
+        self.confirmed_reserved_slots[slot_id] = initial
+        self.occupied |= 1 << SLOT_INDEX[slot_id]
+
+    def clear_slot(self, slot_id: str):
+        self.calendar_outbox.pop(slot_id, None)
+        removed = self.current_round_selections.pop(slot_id, None) or self.confirmed_reserved_slots.pop(slot_id, None)
+        self.occupied &= ~(1 << SLOT_INDEX[slot_id])
+        return removed
+
+    def clear_pending(self):
+        # 캘린더 쓰기를 기다리는 슬롯은 남긴다.
+        for slot_id in self.current_round_selections:
+            if slot_id not in self.calendar_outbox:
+                self.occupied &= ~(1 << SLOT_INDEX[slot_id])
+        self.current_round_selections = {
+            slot_id: name for slot_id, name in self.current_round_selections.items() if slot_id in self.calendar_outbox
+        }
+
+    def clear_slots(self):
+        self.confirmed_reserved_slots = {}
+        self.current_round_selections = {}
+        self.calendar_outbox = {}
+        self.occupied = 0
+
+    def round_open(self):
+        return bool(self.turn_order) and self.current_turn_index < len(self.turn_order)
+
+    def turn_key(self):
+        # 턴 타이머를 다시 걸어야 하는지 비교할 때 쓴다.
+        return self.round_mode, tuple(self.turn_order), self.current_turn_index, self.turn_timeout
+
+    def current_turn_info(self):
+        if self.round_open():
+            if self.round_mode == "preferences":
+                # 선호 목록을 받는 동안에는 특정 사용자의 턴이 아니다.
+                return "PREFERENCES", self.current_turn_index
+            return self.turn_order[self.current_turn_index], self.current_turn_index
+        return "ROUND_END", len(self.turn_order)
+
+    def emit(self, payload: dict, msg_type: str | None = None, versioned: bool = False):
+        version = None
+        if versioned:
+            self.version += 1
+            version = payload["version"] = self.version
+        self.outbox.append((encode_json(payload), msg_type, version))
+
+    def turn_update_payload(self):
+        current_user, current_index = self.current_turn_info()
+        return {
+            "type": "turn_update",
+            "user": current_user,
+            "order": self.turn_order,
+            "current_index": current_index,
+            "timeout": self.turn_timeout
+        }
+
+    def emit_turn_update(self):
+        payload = self.turn_update_payload()
+        logger.debug("턴 알림: %s", payload)
+        self.emit(payload, "turn_update")
+
+    def user_list_payload(self):
+        users = [{"name": name, "participating": data["participating"]} for name, data in self.presence.items()]
+        return {"type": "user_list_update", "users": users}
+
+    def emit_user_list(self):
+        self.emit(self.user_list_payload())
+
+def initial_state_payload(state: SchedulerState, members: dict[str, str]):
+    current_user, current_index = state.current_turn_info()
+    return {
+        "type": "initial_state",
+        "version": state.version,
+        "epoch": state.epoch,
+        "reserved": state.confirmed_reserved_slots,
+        "pending": {slot_id: members.get(name, "??") for slot_id, name in state.current_round_selections.items()},
+        "order": state.turn_order,
+        "current_turn": current_user,
+        "current_index": current_index,
+        "week_mode": state.week_mode,
+        "week_count": state.week_count,
+        "round_mode": state.round_mode,
+        "turn_timeout": state.turn_timeout
+    }
+
+STATE_FRAME_BUILDERS = {
+    "initial_state": initial_state_payload,
+    "turn_update": lambda state, members: state.turn_update_payload(),
+    "week_mode_update": lambda state, members: {
+        "type": "week_mode_update", "mode": state.week_mode, "weeks": state.week_count
+    },
+}
+
+class StateFrameCache:
+    # 접속/재접속 때마다 보내는 상태 프레임을 형식(JSON/바이너리)별로 한 번만 인코딩해 둔다.
+    # 프레임 내용을 정하는 값이 바뀔 때만 비우므로, 라운드 시작 직후처럼 접속이 몰려도(접속 자체는 presence만 바꾼다)
+    # 모든 연결이 같은 인코딩 결과를 재사용한다.
+    def __init__(self, members: dict[str, str]):
+        self.members = members
+        self.key = None
+        self.frames: dict[tuple[str, bool], str | bytes] = {}
+
+    def get(self, state: SchedulerState, kind: str, binary: bool = False):
+        key = (
+            state.epoch, state.version, state.week_mode, state.week_count,
+            state.current_turn_index, tuple(state.turn_order)
+        )
+        if key != self.key:
+            self.key = key
+            self.frames = {}
+        frame = self.frames.get((kind, binary))
+        if frame is None:
+            payload = STATE_FRAME_BUILDERS[kind](state, self.members)
+            frame = encode_binary_payload(payload) if binary else encode_json(payload)
+            self.frames[(kind, binary)] = frame
+        return frame
+
+# --- 상태 변경 명령 ---
+# 모든 상태 변경은 여기 등록된 명령 함수로만 이루어진다. 명령은 검증을 모두 마친 뒤에 상태를 바꿔야 하며
+# (CommandError는 변경 전에 던진다), 인자만으로 결과가 결정되어야 한다 (무작위 순서 등은 호출 쪽에서 정해 넘긴다).
+class CommandError(Exception):
+    pass
+
+ROUND_MODES = ("turns", "preferences")
+
+COMMANDS: dict[str, Any] = {}
+
+def command(name: str, journal: bool = True):
+    # journal=False: 접속 상태처럼 재시작 후에는 의미가 없는 변경. 저널에 남기지 않는다.
+    def decorator(func):
+        func.journal = journal
+        COMMANDS[name] = func
+        return func
+    return decorator
+
+def require_valid_slot(slot_id: str):
+    if slot_id not in SLOT_INDEX:
+        raise CommandError("잘못된 슬롯입니다.")
+
+def require_current_turn(state: SchedulerState, user_name: str | None = None):
+    if not state.turn_order:
+        raise CommandError("라운드가 아직 시작되지 않았습니다.")
+    if state.current_turn_index >= len(state.turn_order):
+        raise CommandError("모든 턴이 종료되었습니다.")
+    if state.round_mode == "preferences":
+        raise CommandError("선호 목록을 제출하는 라운드입니다.")
+    current_user = state.turn_order[state.current_turn_index]
+    if user_name is not None and user_name != current_user:
+        raise CommandError(f"현재 {current_user} 님의 턴입니다.")
+    return current_user
+
+@command("connect", journal=False)
+def cmd_connect(state: SchedulerState, user_name: str, worker: str, conn: str, token: str, resume: str | None = None):
+    # resume: 이전 연결에서 받은 세션 토큰. 맞으면 아직 남아 있는 이전 연결을 대체하고 참여 상태를 이어받는다.
+    # 토큰은 접속할 때마다 새로 발급한다.
+    session = state.sessions.get(user_name)
+    resumed = bool(resume and session and secrets.compare_digest(session["token"], resume))
+    if user_name in state.presence and not resumed:
+        raise CommandError("이미 접속 중인 이름입니다.")
+    participating = session["participating"] if resumed else True
+    state.presence[user_name] = {"participating": participating, "worker": worker, "conn": conn}
+    state.sessions[user_name] = {"token": token, "participating": participating}
+    logger.info("클라이언트 '%s' %s. (총 %d 명)", user_name, "재접속" if resumed else "접속", len(state.presence))
+    state.emit_user_list()
+    return resumed
+
+@command("disconnect", journal=False)
+def cmd_disconnect(state: SchedulerState, user_name: str, conn: str):
+    if state.presence.get(user_name, {}).get("conn") != conn:
+        return
+    del state.presence[user_name]
+    logger.info("클라이언트 '%s' 접속 해제. (남은 인원 %d 명)", user_name, len(state.presence))
+    state.emit_user_list()
+
+@command("drop_workers", journal=False)
+def cmd_drop_workers(state: SchedulerState, workers: list[str]):
+    dropped = [name for name, data in state.presence.items() if data["worker"] in workers]
+    for name in dropped:
+        del state.presence[name]
+    if dropped:
+        logger.warning("응답 없는 워커 %s의 접속자 정리: %s", workers, dropped)
+        state.emit_user_list()
+
+@command("set_participation", journal=False)
+def cmd_set_participation(state: SchedulerState, user_name: str, status: bool):
+    if user_name in state.presence:
+        state.presence[user_name]["participating"] = status
+        state.sessions[user_name]["participating"] = status
+        logger.info("'%s' 님 참여 상태 변경 -> %s", user_name, status)
+        state.emit_user_list()
+
+@command("start_round")
+def cmd_start_round(state: SchedulerState, order: list[str], mode: str = "turns", turn_timeout: float = 0):
+    if not order:
+        raise CommandError("참여자로 설정된 사용자가 없습니다.")
+    if mode not in ROUND_MODES:
+        raise CommandError("잘못된 라운드 모드입니다.")
+    state.clear_pending()
+    state.turn_order = order
+    state.current_turn_index = 0
+    state.round_mode = mode
+    state.turn_timeout = max(float(turn_timeout), 0.0)
+    state.preferences = {}
+    logger.info("새 라운드 순서 (%d명, %s): %s", len(order), mode, order)
+    queued = {slot_id: item["initial"] for slot_id, item in state.calendar_outbox.items()}
+    state.emit({"type": "state_delta", "clear_pending": True, "pending": queued}, versioned=True)
+    state.emit({"type": "round_started", "order": order, "mode": mode, "turn_timeout": state.turn_timeout})
+    state.emit_turn_update()
+
+def require_preference_round(state: SchedulerState):
+    if state.round_mode != "preferences" or not state.round_open():
+        raise CommandError("선호 목록을 받는 중인 라운드가 없습니다.")
+
+@command("submit_preferences")
+def cmd_submit_preferences(state: SchedulerState, user_name: str, slots: list[str]):
+    require_preference_round(state)
+    if user_name not in state.turn_order:
+        raise CommandError("이번 라운드 참여자가 아닙니다.")
+    if not isinstance(slots, list) or not all(isinstance(slot_id, str) for slot_id in slots):
+        raise CommandError("선호 목록 형식이 잘못되었습니다.")
+    for slot_id in slots:
+        require_valid_slot(slot_id)
+    # 같은 슬롯을 여러 번 적으면 가장 높은 순위만 남긴다.
+    state.preferences[user_name] = list(dict.fromkeys(slots))
+    logger.info("'%s' 님 선호 목록 제출 (%d개)", user_name, len(slots))
+    state.emit({
+        "type": "preferences_submitted",
+        "user": user_name,
+        "submitted": len(state.preferences),
+        "total": len(state.turn_order)
+    })
+    # 모두 제출했으면 True. 배정은 호출 쪽에서 캘린더 미러를 반영해 allocate_preferences로 한다.
+    return len(state.preferences) == len(state.turn_order)
+
+@command("allocate_preferences")
+def cmd_allocate_preferences(state: SchedulerState, blocked: list[str], initials: dict[str, str]):
+    # 무작위 순서(turn_order)대로 각자 아직 남은 슬롯 중 가장 선호하는 것 하나를 배정한다 (random serial dictatorship).
+    # blocked: 보드에는 없지만 캘린더에 이미 있는 슬롯
+    require_preference_round(state)
+    taken = state.occupied
+    for slot_id in blocked:
+        taken |= 1 << SLOT_INDEX[slot_id]
+    assignments: dict[str, str | None] = {}
+    pending = {}
+    for user_name in state.turn_order:
+        assignments[user_name] = None
+        for slot_id in state.preferences.get(user_name, ()):
+            bit = 1 << SLOT_INDEX[slot_id]
+            if not taken & bit:
+                taken |= bit
+                state.set_pending(slot_id, user_name)
+                assignments[user_name] = slot_id
+                pending[slot_id] = initials.get(user_name, "??")
+                break
+    state.current_turn_index = len(state.turn_order)
+    state.preferences = {}
+    logger.info("선호 목록 배정 완료: %d/%d명 배정", len(pending), len(state.turn_order))
+    state.emit({"type": "state_delta", "pending": pending}, versioned=True)
+    state.emit({"type": "round_allocated", "assignments": assignments})
+    state.emit_turn_update()
+
+@command("select_slot")
+def cmd_select_slot(state: SchedulerState, user_name: str, slot_id: str, initial: str = "??"):
+    require_current_turn(state, user_name)
+    require_valid_slot(slot_id)
+    if state.is_occupied(slot_id):
+        raise CommandError("이미 선택된 슬롯입니다.")
+    logger.info("'%s' 님이 '%s' 슬롯 선택 (버퍼에 추가)", user_name, slot_id)
+    state.set_pending(slot_id, user_name)
+    state.emit({
+        "type": "slot_update",
+        "slotId": slot_id,
+        "user": user_name,
+        "initial": initial
+    }, versioned=True)
+    state.current_turn_index += 1
+    state.emit_turn_update()
+
+@command("pass_turn")
+def cmd_pass_turn(state: SchedulerState, user_name: str):
+    require_current_turn(state, user_name)
+    logger.info(" > '%s' 님이 턴을 넘겼습니다.", user_name)
+    state.emit({"type": "turn_passed", "user": user_name})
+    state.current_turn_index += 1
+    state.emit_turn_update()
+
+@command("skip_turn")
+def cmd_skip_turn(state: SchedulerState, by: str, index: int | None = None):
+    # index: 타이머처럼 특정 턴을 대상으로 하는 스킵. 그 사이 턴이 넘어갔으면 아무것도 하지 않는다.
+    skipped_user = require_current_turn(state)
+    if index is not None and index != state.current_turn_index:
+        raise CommandError("이미 지난 턴입니다.")
+    logger.info(" > [%s] %s 님의 턴을 스킵했습니다.", "Timer" if by == "timer" else "Admin", skipped_user)
+    state.current_turn_index += 1
+    state.emit({"type": "turn_skipped", "skipped_user": skipped_user, "by": by})
+    state.emit_turn_update()
+
+@command("admin_delete")
+def cmd_admin_delete(state: SchedulerState, slot_id: str):
+    require_valid_slot(slot_id)
+    if not state.is_occupied(slot_id):
+        raise CommandError("존재하지 않는 슬롯입니다.")
+    state.clear_slot(slot_id)
+    state.emit({"type": "state_delta", "removed": [slot_id]}, versioned=True)
+
+@command("reset")
+def cmd_reset(state: SchedulerState):
+    state.clear_slots()
+    state.turn_order = []
+    state.current_turn_index = 0
+    state.round_mode = "turns"
+    state.turn_timeout = 0.0
+    state.preferences = {}
+    state.emit({"type": "state_delta", "reset": True}, versioned=True)
+    state.emit_turn_update()
+
+@command("set_week_mode")
+def cmd_set_week_mode(state: SchedulerState, mode: int, weeks: int = 1):
+    state.week_mode = mode
+    state.week_count = weeks
+    state.emit({"type": "week_mode_update", "mode": mode, "weeks": weeks})
+
+@command("seed_reserved")
+def cmd_seed_reserved(state: SchedulerState, slots: dict[str, str]):
+    # 캘린더에는 있지만 보드에는 없는 예약을 확정 슬롯으로 채운다.
+    added = {slot_id: initial for slot_id, initial in slots.items() if not state.is_occupied(slot_id)}
+    for slot_id, initial in added.items():
+        state.set_reserved(slot_id, initial)
+    if added:
+        state.emit({"type": "state_delta", "reserved": added}, versioned=True)
+
+@command("queue_calendar_writes")
+def cmd_queue_calendar_writes(state: SchedulerState, week_start: str, initials: dict[str, str], weeks: int = 1):
+    # 아직 캘린더 쓰기 대기열에 없는 선택을 모두 넣는다. 실제 쓰기는 방의 CalendarWriter가 한다.
+    targets = [slot_id for slot_id in state.current_round_selections if slot_id not in state.calendar_outbox]
+    if not targets:
+        raise CommandError("새로 추가할 예약이 없습니다.")
+    for slot_id in targets:
+        user_name = state.current_round_selections[slot_id]
+        state.calendar_outbox[slot_id] = {
+            "user": user_name, "initial": initials.get(user_name, "??"), "week_start": week_start, "weeks": weeks
+        }
+    return targets
+
+@command("claim_calendar_writes")
+def cmd_claim_calendar_writes(state: SchedulerState, items: dict[str, dict]):
+    # 관리자 추가(수동/일괄): 캘린더에 쓰기 전에 슬롯을 대기로 잡고 쓰기 대기열에 넣는다.
+    # items: slot_id -> {"user", "initial", "week_start", "weeks"}. 그 사이 차 버린 슬롯은 건너뛰고, 잡은 슬롯 목록을 돌려준다.
+    claimed = {slot_id: item for slot_id, item in items.items() if not state.is_occupied(slot_id)}
+    for slot_id, item in claimed.items():
+        state.set_pending(slot_id, item["user"])
+        state.calendar_outbox[slot_id] = item
+    if claimed:
+        state.emit({
+            "type": "state_delta", "pending": {slot_id: item["initial"] for slot_id, item in claimed.items()}
+        }, versioned=True)
+    return list(claimed)
+
+@command("finish_calendar_writes")
+def cmd_finish_calendar_writes(state: SchedulerState, written: dict[str, str], failed: list[str]):
+    # written: 캘린더에 들어간 슬롯 -> 이니셜, failed: 다시 보내도 소용없는 실패(다른 사람의 일정 등)
+    # 그 사이 관리자 삭제/초기화로 대기열에서 빠진 슬롯은 건드리지 않는다.
+    written = {slot_id: initial for slot_id, initial in written.items() if slot_id in state.calendar_outbox}
+    failed = [slot_id for slot_id in failed if slot_id in state.calendar_outbox]
+    dropped = [f"{slot_id} ({state.calendar_outbox[slot_id]['user']})" for slot_id in failed]
+    for slot_id, initial in written.items():
+        del state.calendar_outbox[slot_id]
+        state.set_reserved(slot_id, initial)
+    for slot_id in failed:
+        state.clear_slot(slot_id)
+    if written or failed:
+        state.emit({"type": "calendar_committed", "committed_data": written, "removed": failed}, versioned=True)
+    if failed:
+        # 보드에서 말없이 사라지지 않도록 빠진 슬롯을 알린다.
+        state.emit({
+            "type": "error", "message": f"캘린더에 다른 사람의 일정이 있어 추가하지 못했습니다: {', '.join(dropped)}"
+        })
+
+# --- 상태 저장소 ---
+class StateJournal:
+    # 스냅샷 + 추가 전용 저널. 명령 이름과 인자만 한 줄씩 기록하고,
+    # 시작할 때 스냅샷을 읽은 뒤 그 이후의 기록만 다시 적용한다.
+    # fsync와 스냅샷 쓰기는 파일을 맡은 전용 스레드 하나에서 차례로 실행해 이벤트 루프를 막지 않는다.
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, "snapshot.json")
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self.seq = 0
+        self.since_snapshot = 0
+        self.file = None
+        self.dirty = False
+        self.fsync_task = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-journal")
+
+    def _call(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def load(self):
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        base_seq = snapshot["seq"] if snapshot else 0
+        records = []
+        if os.path.exists(self.journal_path):
+            good_size = 0
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 기록 도중 죽어서 잘린 마지막 줄. 그 앞까지만 유효하다.
+                        logger.warning("저널 끝의 손상된 기록을 버립니다 (%d bytes).", len(line))
+                        break
+                    good_size += len(line)
+                    if record["seq"] > base_seq:
+                        records.append(record)
+            if good_size != os.path.getsize(self.journal_path):
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(good_size)
+        self.seq = records[-1]["seq"] if records else base_seq
+        self.since_snapshot = len(records)
+        self.file = open(self.journal_path, "a", encoding="utf-8")
+        return (snapshot["state"] if snapshot else None), records
+
+    def append(self, name: str, kwargs: dict):
+        self.seq += 1
+        self.file.write(json.dumps({"seq": self.seq, "cmd": name, "args": kwargs}, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.since_snapshot += 1
+        self.dirty = True
+
+    async def commit(self, state_data: dict | None = None):
+        # 기록 직후 부른다. JOURNAL_FSYNC_INTERVAL이 0이면 여기서 fsync가 끝날 때까지 기다리고,
+        # state_data가 있으면 스냅샷을 쓰고 저널을 비운다.
+        if state_data is not None:
+            await self._call(self.compact, state_data)
+        elif JOURNAL_FSYNC_INTERVAL <= 0:
+            await self._call(self.sync)
+
+    def compact(self, state_data: dict):
+        # 스냅샷을 원자적으로 교체한 뒤 저널을 비운다. 그 사이에 죽어도 seq로 중복 적용을 막는다.
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": self.seq, "state": state_data}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.file.close()
+        self.file = open(self.journal_path, "w", encoding="utf-8")
+        self.since_snapshot = 0
+        self.dirty = False
+
+    def sync(self):
+        if self.dirty and self.file:
+            self.dirty = False
+            os.fsync(self.file.fileno())
+
+    async def run_fsync(self):
+        while True:
+            await asyncio.sleep(JOURNAL_FSYNC_INTERVAL)
+            try:
+                await self._call(self.sync)
+            except Exception as e:
+                logger.error("저널 fsync 실패: %s", e)
+
+    def _close(self):
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    async def close(self):
+        await self._call(self._close)
+        self.executor.shutdown(wait=False)
+
+class InMemoryStateStore:
+    # 단일 프로세스용. 상태를 메모리에 두고 명령을 바로 적용한다.
+    # journal_dir가 있으면 명령을 저널에 남기고 주기적으로 스냅샷을 써서 재시작 후에도 상태를 복구한다.
+    # 워커가 하나뿐이므로 캘린더 쓰기 대기열도 항상 이 워커가 처리한다.
+    owns_calendar_writer = True
+
+    def __init__(self, journal_dir: str | None = None):
+        self.state = SchedulerState()
+        # 메모리에서 내려도(방 비우기) 저널에서 다시 복구할 수 있는지
+        self.durable = journal_dir is not None
+        self.log: collections.deque[tuple[int, str]] = collections.deque(maxlen=STATE_LOG_SIZE)
+        self.journal = StateJournal(journal_dir) if journal_dir else None
+        if self.journal:
+            self._recover()
+
+    def _recover(self):
+        started = time.perf_counter()
+        snapshot, records = self.journal.load()
+        if snapshot:
+            self.state = SchedulerState.from_dict(snapshot)
+        # 재시작 직후에는 아무도 접속해 있지 않다. 캘린더 쓰기 대기열은 그대로 이어서 처리한다.
+        self.state.presence = {}
+        with quiet_logs():
+            for record in records:
+                try:
+                    self._apply(record["cmd"], record["args"])
+                except CommandError:
+                    pass
+        if snapshot or records:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logger.info("상태 복구 완료: 스냅샷 + 저널 %d건 (%.1fms)", len(records), elapsed_ms)
+
+    def read(self) -> SchedulerState:
+        return self.state
+
+    async def refresh(self) -> SchedulerState:
+        return self.state
+
+    def _apply(self, name: str, kwargs: dict):
+        state = self.state
+        state.outbox = []
+        result = COMMANDS[name](state, **kwargs)
+        for message, _, version in state.outbox:
+            if version is not None:
+                self.log.append((version, message))
+        return result, state.outbox
+
+    async def execute(self, name: str, **kwargs):
+        result, outbox = self._apply(name, kwargs)
+        if self.journal and COMMANDS[name].journal:
+            self.journal.append(name, kwargs)
+            data = None
+            if self.journal.since_snapshot >= JOURNAL_COMPACT_EVERY:
+                # 스냅샷은 스레드에서 직렬화한다. 명령 writer가 끝날 때까지 기다리므로 그 사이 상태는 바뀌지 않는다.
+                data = self.state.to_dict()
+                data["presence"] = {}
+            await self.journal.commit(data)
+        return result, outbox
+
+    async def messages_since(self, version: int, epoch: str | None):
+        # version 이후의 변경 메시지 목록. 로그로 메울 수 없는 경우 None (전체 스냅샷 필요).
+        state = self.state
+        if epoch != state.epoch or version > state.version:
+            return None
+        if version == state.version:
+            return []
+        if not self.log or version < self.log[0][0] - 1:
+            return None
+        return [message for v, message in self.log if v > version]
+
+    def publish(self, messages: list[tuple[str, str | None]]):
+        pass
+
+    async def start(self, deliver, submit, lead, turn_changed):
+        if self.journal and JOURNAL_FSYNC_INTERVAL > 0:
+            self.journal.fsync_task = asyncio.create_task(self.journal.run_fsync())
+
+    async def stop(self):
+        if self.journal:
+            if self.journal.fsync_task:
+                self.journal.fsync_task.cancel()
+            await self.journal.close()
+
+class SQLiteStateStore:
+    # 여러 워커가 공유하는 저장소. 명령은 BEGIN IMMEDIATE 트랜잭션 안에서 실행되어 워커 간에도 직렬화되고,
+    # 브로드캐스트는 같은 트랜잭션에서 bus 테이블에 기록되어 다른 워커가 폴링해 각자의 접속자에게 보낸다.
+    # DB 작업은 모두 저장소마다 하나뿐인 스레드에서 실행한다. 다른 워커의 잠금을 기다리는 동안(busy timeout)에도
+    # 이벤트 루프는 막히지 않는다. read()는 마지막으로 읽은 상태를 돌려준다.
+    durable = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+        self.conn = None
+        self.state = SchedulerState()
+        # state 테이블에서 마지막으로 읽은 revision. 폴링은 이 번호만 비교하고, 바뀌었을 때만 data를 읽는다.
+        self.state_revision = None
+        self.last_bus_id = 0
+        # 캘린더 쓰기 임대(lease)를 이 워커가 가지고 있는지. 대기열은 임대를 가진 워커 하나만 처리한다.
+        self.owns_calendar_writer = False
+        self.poll_task = None
+
+    def _call(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS state (
+                id INTEGER PRIMARY KEY CHECK (id = 1), data TEXT NOT NULL, revision INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS state_log (version INTEGER PRIMARY KEY, message TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS bus (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, msg_type TEXT, message TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, seen_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, worker_id TEXT NOT NULL, expires_at REAL NOT NULL);
+        """)
+        if "revision" not in {row[1] for row in self.conn.execute("PRAGMA table_info(state)")}:
+            # revision 열이 생기기 전에 만든 DB
+            self.conn.execute("ALTER TABLE state ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute(
+            "INSERT OR IGNORE INTO state (id, data) VALUES (1, ?)", (json.dumps(SchedulerState().to_dict()),)
+        )
+        self.last_bus_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM bus").fetchone()[0]
+        return self._refresh()
+
+    def _load(self) -> tuple[SchedulerState, int]:
+        data, revision = self.conn.execute("SELECT data, revision FROM state WHERE id = 1").fetchone()
+        return SchedulerState.from_dict(json.loads(data)), revision
+
+    def read(self) -> SchedulerState:
+        return self.state
+
+    def _refresh(self):
+        state, self.state_revision = self._load()
+        return state
+
+    async def refresh(self) -> SchedulerState:
+        # 다른 워커의 최근 변경(접속자 등)까지 반영된 상태가 꼭 필요할 때. 평소의 read()는 폴링 주기만큼 늦을 수 있다.
+        self.state = await self._call(self._refresh)
+        return self.state
+
+    def _execute(self, name: str, kwargs: dict):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            state, revision = self._load()
+            result = COMMANDS[name](state, **kwargs)
+            self.conn.execute(
+                "UPDATE state SET data = ?, revision = ? WHERE id = 1", (json.dumps(state.to_dict()), revision + 1)
+            )
+            for message, msg_type, version in state.outbox:
+                if version is not None:
+                    self.conn.execute("INSERT INTO state_log (version, message) VALUES (?, ?)", (version, message))
+                self.conn.execute(
+                    "INSERT INTO bus (origin, msg_type, message) VALUES (?, ?, ?)", (WORKER_ID, msg_type, message)
+                )
+            if any(version is not None for _, _, version in state.outbox):
+                self.conn.execute("DELETE FROM state_log WHERE version <= ?", (state.version - STATE_LOG_SIZE,))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.state_revision = revision + 1
+        return state, result
+
+    async def execute(self, name: str, **kwargs):
+        state, result = await self._call(self._execute, name, kwargs)
+        self.state = state
+        return result, state.outbox
+
+    def _messages_since(self, version: int, epoch: str | None):
+        state, _ = self._load()
+        if epoch != state.epoch or version > state.version:
+            return None
+        if version == state.version:
+            return []
+        rows = self.conn.execute(
+            "SELECT version, message FROM state_log WHERE version > ? ORDER BY version", (version,)
+        ).fetchall()
+        if not rows or rows[0][0] != version + 1:
+            return None
+        return [message for _, message in rows]
+
+    async def messages_since(self, version: int, epoch: str | None):
+        return await self._call(self._messages_since, version, epoch)
+
+    def _publish(self, messages: list[tuple[str, str | None]]):
+        try:
+            self.conn.executemany(
+                "INSERT INTO bus (origin, msg_type, message) VALUES (?, ?, ?)",
+                [(WORKER_ID, msg_type, message) for message, msg_type in messages]
+            )
+        except Exception as e:
+            logger.error("상태 버스 기록 실패: %s", e)
+
+    def publish(self, messages: list[tuple[str, str | None]]):
+        # 기다리지 않는다. 같은 스레드에서 차례로 실행되므로 순서는 유지된다.
+        self.executor.submit(self._publish, messages)
+
+    async def start(self, deliver, submit, lead, turn_changed):
+        # submit: 명령을 방의 명령 큐로 보내는 함수. 이 저장소도 상태를 직접 바꾸지 않는다.
+        # lead: 이 워커가 캘린더 쓰기를 맡아야 할 때(임대를 얻었거나 다른 워커가 대기열에 넣었을 때) 부른다.
+        # turn_changed: 다른 워커의 명령으로 턴이 바뀌었을 때 부른다. 워커마다 턴 타이머를 걸어 두므로
+        # 타이머를 건 워커가 죽어도 턴이 멈추지 않는다 (skip_turn은 턴 번호를 확인하므로 한 번만 적용된다).
+        self.state = await self._call(self._open)
+        self.poll_task = asyncio.create_task(self._poll(deliver, submit, lead, turn_changed))
+
+    def _close(self):
+        self.conn.execute("DELETE FROM workers WHERE worker_id = ?", (WORKER_ID,))
+        self.conn.execute("DELETE FROM leases WHERE worker_id = ?", (WORKER_ID,))
+        self.conn.close()
 
-client_connections: dict[str, dict[str, Any]] = {}
-turn_order: list[str] = []
-current_turn_index: int = 0
-week_mode = 1
-confirmed_reserved_slots: dict[str, str] = {}
-current_round_selections: dict[str, str] = {}
+    async def stop(self):
+        if self.poll_task:
+            self.poll_task.cancel()
+        if self.conn:
+            await self._call(self._close)
+        self.executor.shutdown(wait=False)
+
+    def _poll_once(self, heartbeat_at: float | None):
+        # (다른 워커가 보낸 메시지, 바뀌었으면 최신 상태 아니면 None, 응답 없는 워커 목록)
+        rows = self.conn.execute(
+            "SELECT id, origin, msg_type, message FROM bus WHERE id > ? ORDER BY id", (self.last_bus_id,)
+        ).fetchall()
+        remote = []
+        if rows:
+            self.last_bus_id = rows[-1][0]
+            remote = [(message, msg_type) for _, origin, msg_type, message in rows if origin != WORKER_ID]
+        revision = self.conn.execute("SELECT revision FROM state WHERE id = 1").fetchone()[0]
+        state = self._refresh() if revision != self.state_revision else None
+        dead = self._heartbeat(heartbeat_at) if heartbeat_at is not None else []
+        return remote, state, dead
+
+    async def _poll(self, deliver, submit, lead, turn_changed):
+        last_heartbeat = 0.0
+        while True:
+            try:
+                now = time.time()
+                heartbeat_at = now if now - last_heartbeat >= 1 else None
+                if heartbeat_at is not None:
+                    last_heartbeat = now
+                was_leader = self.owns_calendar_writer
+                remote, state, dead = await self._call(self._poll_once, heartbeat_at)
+                turn_moved = False
+                if state is not None:
+                    turn_moved = state.turn_key() != self.state.turn_key()
+                    self.state = state
+                if remote:
+                    deliver(remote)
+                if turn_moved:
+                    turn_changed()
+                if dead:
+                    spawn(submit("drop_workers", workers=dead))
+                if self.owns_calendar_writer and (not was_leader or (state is not None and state.calendar_outbox)):
+                    lead()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("상태 버스 폴링 실패: %s", e)
+            await asyncio.sleep(BUS_POLL_INTERVAL)
+
+    def _heartbeat(self, now: float):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO workers (worker_id, seen_at) VALUES (?, ?)", (WORKER_ID, now)
+        )
+        # 캘린더 쓰기 임대를 갱신하거나, 가진 워커가 응답이 없으면 넘겨받는다.
+        self.conn.execute("""
+            INSERT INTO leases (name, worker_id, expires_at) VALUES ('calendar_writer', ?, ?)
+            ON CONFLICT (name) DO UPDATE SET worker_id = excluded.worker_id, expires_at = excluded.expires_at
+            WHERE leases.worker_id = excluded.worker_id OR leases.expires_at < ?
+        """, (WORKER_ID, now + WORKER_TIMEOUT, now))
+        owner = self.conn.execute("SELECT worker_id FROM leases WHERE name = 'calendar_writer'").fetchone()
+        self.owns_calendar_writer = owner is not None and owner[0] == WORKER_ID
+        dead = [row[0] for row in self.conn.execute(
+            "SELECT worker_id FROM workers WHERE seen_at < ?", (now - WORKER_TIMEOUT,)
+        ).fetchall()]
+        if dead:
+            self.conn.execute(
+                f"DELETE FROM workers WHERE worker_id IN ({','.join('?' * len(dead))})", dead
+            )
+        # 모든 워커가 이미 읽었을 만큼 오래된 버스 메시지는 정리한다.
+        self.conn.execute("DELETE FROM bus WHERE id < ?", (self.last_bus_id - 10000,))
+        return dead
+
+def create_store(room_id: str):
+    # 기본 방은 기존 경로를 그대로 쓰고, 다른 방은 방 ID로 구분한 DB 파일/저널 디렉터리를 쓴다.
+    if STATE_BACKEND == "sqlite":
+        if room_id == DEFAULT_ROOM:
+            return SQLiteStateStore(STATE_DB_PATH)
+        root, ext = os.path.splitext(STATE_DB_PATH)
+        return SQLiteStateStore(f"{root}.{room_id}{ext}")
+    if not STATE_JOURNAL_DIR:
+        return InMemoryStateStore(None)
+    if room_id == DEFAULT_ROOM:
+        return InMemoryStateStore(STATE_JOURNAL_DIR)
+    return InMemoryStateStore(os.path.join(STATE_JOURNAL_DIR, "rooms", room_id))
 
 # --- Helper Functions ---
-async def broadcast(message: str):
-    for user_data in client_connections.values():
-        client_ws = user_data.get("ws")
-        if client_ws:
+def deliver_local(room: "Room", messages: list[tuple[str, str | None]]):
+    # 이 워커의 각 연결 송신 큐에 넣기만 하고 실제 전송은 연결별 writer task가 담당한다.
+    # 바이너리 연결용 프레임은 연결마다가 아니라 브로드캐스트마다 한 번만 만든다.
+    # 한 연결에서 난 오류는 그 연결만 건너뛰고 나머지 연결에는 그대로 보낸다.
+    with BROADCAST_SECONDS.time():
+        binary_messages = None
+        for user_data in list(room.connections.values()):
+            channel = user_data.get("channel")
+            if not channel:
+                continue
             try:
-                await client_ws.send_text(message)
+                outgoing = messages
+                if channel.binary:
+                    if binary_messages is None:
+                        binary_messages = [(encode_binary(message), msg_type) for message, msg_type in messages]
+                    outgoing = binary_messages
+                for message, msg_type in outgoing:
+                    channel.send(message, msg_type)
             except Exception as e:
-                print(f"브로드캐스트 실패: {e}")
+                BROADCAST_FAILURES.inc(reason="error")
+                logger.exception("'%s' 님에게 보내기 실패: %s", channel.user_name, e)
 
-async def notify_turn():
-    global current_turn_index, turn_order
-    if current_turn_index < len(turn_order):
-        current_user = turn_order[current_turn_index]
-        idx = current_turn_index
-    else:
-        current_user = "ROUND_END"
-        idx = len(turn_order)
-    message = json.dumps({
-        "type": "turn_update",
-        "user": current_user,
-        "order": turn_order,
-        "current_index": idx
-    })
-    print(f"턴 알림: {message}")
-    await broadcast(message)
-
-async def broadcast_user_list():
-    user_list = []
-    for user_name, data in client_connections.items():
-        user_list.append({
-            "name": user_name,
-            "participating": data.get("participating", True)
-        })
-    await broadcast(json.dumps({"type": "user_list_update", "users": user_list}))
+async def broadcast(room: "Room", message: str, msg_type: str | None = None):
+    # 상태와 무관한 메시지(채팅, 진행률 등)를 이 방의 모든 워커 접속자에게 보낸다.
+    deliver_local(room, [(message, msg_type)])
+    room.store.publish([(message, msg_type)])
 
-async def broadcast_initial_state():
-    pending_with_initials = {
-        slot_id: name_map.get(user_name, "??") 
-        for slot_id, user_name in current_round_selections.items()
-    }
-    if turn_order and current_turn_index < len(turn_order):
-        current_user = turn_order[current_turn_index]
-        current_index = current_turn_index
-    else:
-        current_user = "ROUND_END"
-        current_index = len(turn_order)
-    
-    await broadcast(json.dumps({
-        "type": "initial_state",
-        "reserved": confirmed_reserved_slots,
-        "pending": pending_with_initials,
-        "order": turn_order,
-        "current_turn": current_user,
-        "current_index": current_index
-    }))
-
-def get_event_datetime(day_str, time_str, current_week_mode):
-    day_map = {'Mon': 0, 'Tue': 1, 'Wed': 2, 'Thu': 3, 'Fri': 4, 'Sat': 5, 'Sun': 6}
-    time_map = {'AM': (8, 0, 13, 0), 'PM': (13, 0, 19, 0), 'NT': (19, 0, 24, 0)}
-    day_num = day_map.get(day_str)
-    time_data = time_map.get(time_str)
-
-    if day_num is None or time_data is None:
-        raise ValueError(f"Invalid day/time: {day_str}, {time_str}")
-    
-    start_hour, start_minute, end_hour, end_minute = time_data
+async def run_command(room: "Room", name: str, **kwargs):
+    # 명령을 방의 명령 큐에 넣고 결과를 기다린다. 실제 적용은 방마다 하나뿐인 writer task(Room.run_commands)가
+    # 도착 순서대로 하므로 명령들은 서로 끼어들지 않는다. 큐가 가득 차면 자리가 날 때까지 기다린다.
+    # 검증 실패 시 CommandError.
+    room.last_active = time.monotonic()
+    future = asyncio.get_running_loop().create_future()
+    await room.commands.put((name, kwargs, future))
+    return await future
+
+async def apply_commands(room: "Room", batch: list[tuple[str, dict, asyncio.Future]]):
+    # 명령을 차례로 저장소에 적용하고, 만들어진 브로드캐스트를 모아 이 워커에 있는 그 방의 접속자에게 한 번에 보낸다.
+    # (다른 워커의 접속자에게는 저장소가 전달한다.) 결과는 브로드캐스트를 큐에 넣은 뒤에 돌려준다.
+    # 명령은 이미 적용(저널 기록)되었으므로, 그 뒤의 전달 과정에서 오류가 나도 결과는 명령의 결과 그대로 돌려준다.
+    outcomes = []
+    messages: list[tuple[str, str | None]] = []
+    for name, kwargs, future in batch:
+        try:
+            with COMMAND_SECONDS.time(command=name):
+                result, outbox = await room.store.execute(name, **kwargs)
+        except Exception as e:
+            outcomes.append((future, None, e))
+            continue
+        outcomes.append((future, result, None))
+        messages.extend((message, msg_type) for message, msg_type, _ in outbox)
+
+    try:
+        turn_updates = [message for message, msg_type in messages if msg_type == "turn_update"]
+        if turn_updates:
+            # 배치 안에서 이미 지나간 턴 알림은 보내지 않는다 (마지막 것만 의미가 있다).
+            last_turn_update = turn_updates[-1]
+            messages = [(message, msg_type) for message, msg_type in messages
+                        if msg_type != "turn_update" or message is last_turn_update]
+            if room.round_started_at is not None and any(json.loads(m)["user"] == "ROUND_END" for m in turn_updates):
+                ROUND_DURATION_SECONDS.observe(time.monotonic() - room.round_started_at)
+                room.round_started_at = None
+        if messages:
+            deliver_local(room, messages)
+        if turn_updates:
+            room.arm_turn_timer()
+    finally:
+        for future, result, error in outcomes:
+            # 기다리던 쪽이 이미 취소된 경우(연결 종료 등)에도 명령 자체는 적용된 상태다.
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+async def allocate_preferences(room: "Room"):
+    # 캘린더에만 있는 예약도 배정 대상에서 뺀다.
+    state = room.store.read()
+    blocked = slot_ids_in_mask(room.mirror.span_mask(target_weeks(state)))
+    initials = {name: room.members.get(name, "??") for name in state.turn_order}
+    await run_command(room, "allocate_preferences", blocked=blocked, initials=initials)
+
+async def send_state_since(room: "Room", channel: "ClientChannel", version: int | None, epoch: str | None):
+    messages = await room.store.messages_since(version, epoch) if version is not None else None
+    if messages is None:
+        channel.send(room.frames.get(room.store.read(), "initial_state", channel.binary), "initial_state")
+        return
+    for message in messages:
+        channel.send(message)
+
+def target_week_start(current_week_mode):
+    # week_mode가 가리키는 주의 월요일
     today = datetime.date.today()
-    if current_week_mode == 0:
-        days_diff = day_num - today.weekday()
-    elif current_week_mode == 1:
-        days_diff = 7 - today.weekday() + day_num
-    else:
-        days_diff = 14 - today.weekday() + day_num
-    
-    event_date = today + datetime.timedelta(days=days_diff)
-    start_time = datetime.datetime.combine(event_date, datetime.time(start_hour, start_minute, tzinfo=GCalendar.KST))
-    if end_hour == 24:
-        end_time = datetime.datetime.combine(event_date + datetime.timedelta(days=1), datetime.time(0, 0, tzinfo=GCalendar.KST))
-    else:
-        end_time = datetime.datetime.combine(event_date, datetime.time(end_hour, end_minute, tzinfo=GCalendar.KST))
-    return start_time.isoformat(), end_time.isoformat()
+    return today - datetime.timedelta(days=today.weekday()) + datetime.timedelta(weeks=current_week_mode)
 
-# --- HTTP Routes ---
-@app.get("/")
-async def get_root():
+def target_weeks(state: SchedulerState):
+    # 이번 라운드가 예약하는 모든 주의 월요일
+    week_start = target_week_start(state.week_mode)
+    return [week_start + datetime.timedelta(weeks=i) for i in range(state.week_count)]
+
+# --- 캘린더 미러 ---
+
+class CalendarMirror:
+    # 방 캘린더의 로컬 사본. (주 시작일, slot_id)로 색인해 충돌 검사를 API 호출 없이 O(1)로 한다.
+    # 처음 한 번 전체 목록을 받은 뒤에는 events().list의 syncToken으로 변경분만 가져온다.
+    def __init__(self, room: "Room"):
+        self.room = room
+        self.floors = {calendar_id: floor for floor, calendar_id in room.calendar_ids.items()}
+        self.sync_tokens: dict[str, str] = {}
+        # (calendar_id, event_id) -> (week_start, slot_id)
+        self.events: dict[tuple[str, str], tuple[str, str]] = {}
+        # (week_start, slot_id) -> {event_id: 이니셜(summary)}
+        self.slots: dict[tuple[str, str], dict[str, str]] = {}
+        # week_start -> 캘린더에 일정이 있는 슬롯의 비트마스크
+        self.week_masks: dict[str, int] = {}
+        self.task = None
+
+    def week_mask(self, week_start: datetime.date):
+        return self.week_masks.get(week_start.isoformat(), 0)
+
+    def span_mask(self, weeks: list[datetime.date]):
+        # 여러 주 중 한 주라도 캘린더에 일정이 있는 슬롯
+        mask = 0
+        for week_start in weeks:
+            mask |= self.week_mask(week_start)
+        return mask
+
+    def lookup(self, week_start: datetime.date, slot_id: str):
+        events = self.slots.get((week_start.isoformat(), slot_id))
+        if events:
+            return next(iter(events.values()))
+        return None
+
+    def _event_slot(self, calendar_id, item):
+        start = item.get('start', {}).get('dateTime')
+        if not start:
+            return None
+        start_time = datetime.datetime.fromisoformat(start).astimezone(GCalendar.KST)
+        event_date = start_time.date()
+        week_start = (event_date - datetime.timedelta(days=event_date.weekday())).isoformat()
+        slot_id = item.get('description') or ''
+        if slot_id not in SLOT_INDEX:
+            # 캘린더에서 직접 만든 일정: 시작 시각과 캘린더(층)로 슬롯을 추정한다.
+            time_str = SLOT_START_HOURS.get(start_time.hour) if start_time.minute == 0 else None
+            if not time_str:
+                return None
+            slot_id = f"{SLOT_DAYS[event_date.weekday()]}-{time_str}-{self.floors[calendar_id]}"
+        return week_start, slot_id
+
+    def _remove(self, key):
+        entry = self.events.pop(key, None)
+        if entry:
+            events = self.slots.get(entry)
+            if events:
+                events.pop(key[1], None)
+                if not events:
+                    del self.slots[entry]
+                    week_start, slot_id = entry
+                    self.week_masks[week_start] &= ~(1 << SLOT_INDEX[slot_id])
+
+    @staticmethod
+    def _instances(item):
+        # 반복 일정(삽입 응답)을 주별 인스턴스로 펼친다. 인스턴스 ID는 Calendar가 쓰는 "{id}_{UTC 시작 시각}" 형식이라
+        # 이후 singleEvents 동기화로 받는 인스턴스 변경분과 같은 키가 된다. 직접 쓴 weekly COUNT 규칙만 이해한다.
+        recurrence = item.get('recurrence')
+        if not recurrence:
+            return [item]
+        match = re.fullmatch(r"RRULE:FREQ=WEEKLY;COUNT=(\d+)", recurrence[0])
+        start = item.get('start', {}).get('dateTime')
+        if not match or not start:
+            return []
+        first = datetime.datetime.fromisoformat(start)
+        instances = []
+        for i in range(int(match.group(1))):
+            instance_start = first + datetime.timedelta(weeks=i)
+            instance_id = f"{item['id']}_{instance_start.astimezone(datetime.timezone.utc):%Y%m%dT%H%M%SZ}"
+            instances.append({**item, 'id': instance_id, 'start': {'dateTime': instance_start.isoformat()}})
+        return instances
+
+    def apply(self, calendar_id, items, full=False):
+        if full:
+            for key in [key for key in self.events if key[0] == calendar_id]:
+                self._remove(key)
+        for item in (instance for item in items for instance in self._instances(item)):
+            key = (calendar_id, item['id'])
+            self._remove(key)
+            if item.get('status') == 'cancelled':
+                continue
+            entry = self._event_slot(calendar_id, item)
+            if entry:
+                self.events[key] = entry
+                self.slots.setdefault(entry, {})[item['id']] = item.get('summary') or '??'
+                week_start, slot_id = entry
+                self.week_masks[week_start] = self.week_masks.get(week_start, 0) | 1 << SLOT_INDEX[slot_id]
+
+    def _fetch(self, calendar_id):
+        # 워커 스레드에서 실행. (변경된 일정 목록, 새 syncToken, 전체 동기화 여부)
+        sync_token = self.sync_tokens.get(calendar_id)
+        full = sync_token is None
+        time_min = datetime.datetime.combine(target_week_start(0), datetime.time(0, tzinfo=GCalendar.KST)).isoformat()
+        items, page_token = [], None
+        while True:
+            try:
+                response = calendar_service.list_events(calendar_id, sync_token=sync_token, page_token=page_token, time_min=time_min)
+            except google_client().HttpError as e:
+                if e.resp.status == 410 and sync_token:
+                    logger.warning("캘린더 syncToken 만료 (%s). 전체 동기화를 다시 합니다.", self.floors[calendar_id])
+                    sync_token, full, items, page_token = None, True, [], None
+                    continue
+                raise
+            items.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return items, response.get('nextSyncToken'), full
+
+    async def refresh(self):
+        for calendar_id in self.room.calendar_ids.values():
+            items, sync_token, full = await asyncio.to_thread(self._fetch, calendar_id)
+            self.apply(calendar_id, items, full)
+            if sync_token:
+                self.sync_tokens[calendar_id] = sync_token
+        await self.seed_board()
+
+    async def seed_board(self):
+        # 현재 예약 대상 주들에 캘린더로만 존재하는 예약을 보드에 반영한다.
+        state = self.room.store.read()
+        weeks = target_weeks(state)
+        missing = {
+            slot_id: next(initial for initial in (self.lookup(week_start, slot_id) for week_start in weeks) if initial is not None)
+            for slot_id in slot_ids_in_mask(self.span_mask(weeks) & ~state.occupied)
+        }
+        if missing:
+            logger.info("캘린더 미러에서 보드에 없는 예약 %d건 반영: %s", len(missing), missing)
+            await run_command(self.room, "seed_reserved", slots=missing)
+
+    async def run(self):
+        while True:
+            try:
+                if not calendar_service.service and calendar_service.has_stored_credentials():
+                    await ensure_calendar_service(interactive=False)
+                if calendar_service.service:
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("캘린더 미러 갱신 실패: %s", e)
+            await asyncio.sleep(CALENDAR_SYNC_INTERVAL)
+
+    def start(self):
+        if CALENDAR_SYNC_INTERVAL > 0:
+            self.task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+# --- 캘린더 쓰기 ---
+def write_calendar_chunk(calendar_id, items):
+    # 워커 스레드에서 실행. items: [(slot_id, initial, start, end, event_id, weeks)]
+    # 입력과 같은 순서로 (일정, 결과) 목록을 돌려준다.
+    # 결과: written, failed(같은 ID의 일정이 다른 사람 것이라 다시 보내도 소용없음), auth(인증 오류), retry(그 밖의 실패)
+    results = calendar_service.insert_events_batch(
+        calendar_id,
+        [(initial, start, end, slot_id, event_id, weeks) for slot_id, initial, start, end, event_id, weeks in items]
+    )
+    outcomes = []
+    for (slot_id, initial, start, end, event_id, weeks), (event, error) in zip(items, results):
+        if GCalendar.is_conflict(error):
+            try:
+                event = calendar_service.claim_existing_event(calendar_id, event_id, initial, start, end, slot_id, weeks)
+                error = None if event else error
+            except Exception as e:
+                event, error = None, e
+        if event:
+            outcomes.append((event, "written"))
+        elif GCalendar.is_conflict(error):
+            outcomes.append((None, "failed"))
+        else:
+            outcomes.append((None, "auth" if GCalendar.is_auth_error(error) else "retry"))
+        CALENDAR_EVENTS.inc(op="batch", result={"written": "success", "failed": "failure"}.get(outcomes[-1][1], "retry"))
+    return outcomes
+
+def calendar_write_item(room: "Room", slot_id: str, initial: str, week_start: datetime.date, weeks: int = 1):
+    # write_calendar_items에 넘길 (calendar_id, write_calendar_chunk 항목)
+    day_num, time_str, floor = SLOT_PARTS[SLOT_INDEX[slot_id]]
+    calendar_id = room.calendar_ids[floor]
+    start_iso, end_iso = slot_time_table.for_week(week_start)[(day_num, time_str)]
+    event_id = GCalendar.event_id(calendar_id, week_start.isoformat(), slot_id, weeks)
+    return calendar_id, (slot_id, initial, start_iso, end_iso, event_id, weeks)
+
+async def write_calendar_items(room: "Room", items: list[tuple[str, tuple]], on_chunk=None):
+    # 캘린더별로 CALENDAR_BATCH_SIZE개씩 묶어 COMMIT_CONCURRENCY개까지 동시에 보내고, 들어간 일정은 미러에 반영한다.
+    # 입력과 같은 순서로 결과(written/failed/retry) 목록을 돌려준다. 인증 오류는 Credential을 다시 읽고 retry로 돌려준다.
+    # on_chunk(done): 묶음 하나가 끝날 때마다 그 묶음의 [(항목, 결과)] 목록으로 부른다 (진행률 표시용).
+    results: list[str | None] = [None] * len(items)
+    auth_failed = False
+    by_calendar: dict[str, list[int]] = {}
+    for i, (calendar_id, _) in enumerate(items):
+        by_calendar.setdefault(calendar_id, []).append(i)
+    chunks = [
+        (calendar_id, indices[i:i + CALENDAR_BATCH_SIZE])
+        for calendar_id, indices in by_calendar.items()
+        for i in range(0, len(indices), CALENDAR_BATCH_SIZE)
+    ]
+    semaphore = asyncio.Semaphore(COMMIT_CONCURRENCY)
+
+    async def run_chunk(calendar_id, indices):
+        nonlocal auth_failed
+        async with semaphore:
+            with CALENDAR_REQUEST_SECONDS.time(op="batch"):
+                outcomes = await asyncio.to_thread(write_calendar_chunk, calendar_id, [items[i][1] for i in indices])
+        room.mirror.apply(calendar_id, [event for event, _ in outcomes if event])
+        for i, (_, result) in zip(indices, outcomes):
+            if result == "auth":
+                auth_failed = True
+                result = "retry"
+            results[i] = result
+        if on_chunk:
+            await on_chunk([(items[i][1], results[i]) for i in indices])
+
+    await asyncio.gather(*(run_chunk(calendar_id, indices) for calendar_id, indices in chunks))
+    if auth_failed:
+        await reload_calendar_credentials()
+    return results
+
+class CalendarWriter:
+    # 방 상태의 calendar_outbox를 백그라운드에서 캘린더에 쓴다. 이벤트 ID가 (주, 슬롯)으로 정해져 있어
+    # 같은 항목을 몇 번 다시 보내도(재시작, 타임아웃 후 재시도, 여러 워커) 일정은 하나만 생긴다.
+    # 일시적인 실패는 지수 백오프 + 지터로 다시 보내고, 성공할 때까지 슬롯은 보드에 대기로 남는다.
+    def __init__(self, room: "Room"):
+        self.room = room
+        # slot_id -> (연속 실패 횟수, 다음 시도 시각(monotonic))
+        self.retry: dict[str, tuple[int, float]] = {}
+        self.wakeup = asyncio.Event()
+        self.busy = False
+        self.task = None
+
+    def notify(self):
+        self.wakeup.set()
+
+    def _backoff(self, slot_ids):
+        now = time.monotonic()
+        for slot_id in slot_ids:
+            attempts = self.retry.get(slot_id, (0, 0.0))[0] + 1
+            delay = min(CALENDAR_RETRY_BASE * 2 ** (attempts - 1), CALENDAR_RETRY_MAX)
+            self.retry[slot_id] = (attempts, now + random.uniform(delay / 2, delay))
+
+    async def drain(self):
+        if not self.room.store.owns_calendar_writer:
+            # 여러 워커가 같은 저장소를 쓸 때는 임대를 가진 워커 하나만 캘린더에 쓴다.
+            return
+        outbox = self.room.store.read().calendar_outbox
+        for slot_id in [slot_id for slot_id in self.retry if slot_id not in outbox]:
+            del self.retry[slot_id]
+        now = time.monotonic()
+        due = {slot_id: item for slot_id, item in outbox.items() if self.retry.get(slot_id, (0, 0.0))[1] <= now}
+        if not due:
+            return
+        try:
+            await ensure_calendar_service(interactive=False)
+        except Exception as e:
+            logger.warning("캘린더 쓰기 보류 (%d건): %s", len(due), e)
+            self._backoff(due)
+            return
+
+        written: dict[str, str] = {}
+        failed: list[str] = []
+        items: list[tuple[str, tuple]] = []
+        for slot_id, item in due.items():
+            week_start = datetime.date.fromisoformat(item["week_start"])
+            weeks = item.get("weeks", 1)
+            # 대상 주 전체에서 충돌을 본다.
+            existing = [
+                self.room.mirror.lookup(week_start + datetime.timedelta(weeks=i), slot_id) for i in range(weeks)
+            ]
+            if all(initial == item["initial"] for initial in existing):
+                # 이전 시도에서 이미 들어간 일정. 다시 넣지 않는다.
+                logger.info("  > %s (%s) 이미 캘린더에 있음.", slot_id, item["user"])
+                written[slot_id] = item["initial"]
+                continue
+            others = {initial for initial in existing if initial and initial != item["initial"]}
+            if others:
+                logger.warning("  > %s (%s) 추가 실패: 캘린더에 %s 님의 일정이 이미 있습니다.", slot_id, item["user"], others)
+                failed.append(slot_id)
+                continue
+            items.append(calendar_write_item(self.room, slot_id, item["initial"], week_start, weeks))
+
+        done = len(due) - len(items)
+        retrying: list[str] = []
+
+        async def on_chunk(chunk_done):
+            nonlocal done
+            for (slot_id, initial, *_), result in chunk_done:
+                if result == "written":
+                    written[slot_id] = initial
+                elif result == "failed":
+                    failed.append(slot_id)
+                else:
+                    retrying.append(slot_id)
+            done += len(chunk_done)
+            await broadcast(self.room, encode_json({
+                "type": "commit_progress",
+                "done": done,
+                "total": len(due),
+                "succeeded": len(written),
+                "retrying": len(retrying)
+            }), "commit_progress")
+
+        await write_calendar_items(self.room, items, on_chunk)
+
+        for slot_id in (*written, *failed):
+            self.retry.pop(slot_id, None)
+        self._backoff(retrying)
+        if retrying:
+            logger.warning("캘린더 쓰기 %d건 실패, 나중에 다시 시도합니다: %s", len(retrying), retrying)
+        if written or failed:
+            await run_command(self.room, "finish_calendar_writes", written=written, failed=failed)
+
+    async def run(self):
+        while True:
+            timeout = None
+            if self.retry:
+                timeout = max(min(not_before for _, not_before in self.retry.values()) - time.monotonic(), 0)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            self.busy = True
+            try:
+                await self.drain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[캘린더 쓰기 에러] %s", e)
+                self._backoff(self.room.store.read().calendar_outbox)
+            finally:
+                self.busy = False
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        # 재시작 전에 남은 대기열이 있으면 바로 이어서 쓴다.
+        self.notify()
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+# --- 방(room) ---
+# 방마다 멤버, 캘린더, 관리자, 상태 저장소, 접속자 목록, 캘린더 미러가 따로 있어 한 방의 브로드캐스트가 다른 방 접속자를 건드리지 않는다.
+# 기본 방은 names.json / CALENDAR_IDS를 쓰고 기존 경로(/, /ws/{user_name} 등)로 접근한다.
+# 그 외의 방은 ROOM_CONFIG 파일에 정의하고 /rooms/{room_id}/... 경로로 접근한다:
+#   {"lab2": {"members": {"이름": "이니셜", ...}, "calendars": {"1F": "...", "3F": "..."}, "admin": "이름"}}
+# members 대신 "names_file"로 names.json 형식의 파일을 지정할 수도 있다.
+DEFAULT_ROOM = "default"
+ROOM_CONFIG = os.environ.get("ROOM_CONFIG", "rooms.json")
+# 라운드 시작 시 turn_timeout을 주지 않았을 때 쓰는 턴 제한 시간(초). 0이면 제한 없음.
+TURN_TIMEOUT = float(os.environ.get("TURN_TIMEOUT", "0"))
+# 접속자 없이 이 시간(초)이 지난 방은 메모리에서 내리고, 다음 접근 때 저장소에서 다시 올린다. 0이면 내리지 않는다.
+ROOM_IDLE_TIMEOUT = float(os.environ.get("ROOM_IDLE_TIMEOUT", "900"))
+# 방마다 명령 큐에 쌓일 수 있는 최대 명령 수. 가득 차면 새 명령을 넣는 쪽이 기다린다.
+COMMAND_QUEUE_SIZE = int(os.environ.get("COMMAND_QUEUE_SIZE", "1024"))
+# writer task가 한 번에 꺼내 적용하고 브로드캐스트를 묶어 보내는 최대 명령 수
+COMMAND_BATCH_SIZE = int(os.environ.get("COMMAND_BATCH_SIZE", "64"))
+ROOM_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def load_room_configs():
+    configs = {DEFAULT_ROOM: {"members": name_map, "calendar_ids": CALENDAR_IDS, "admin": ADMIN_NAME}}
     try:
-        with open("index.html", "r", encoding="utf-8") as f:
-            html = f.read()
+        with open(ROOM_CONFIG, 'r', encoding='utf-8') as f:
+            data = json.load(f)
     except FileNotFoundError:
-        html = "<html><body><h1>index.html 파일을 찾을 수 없습니다.</h1></body></html>"
-    return HTMLResponse(html)
+        return configs
+    except (OSError, ValueError) as e:
+        logger.error("방 설정 파일(%s)을 읽을 수 없습니다: %s. 기본 방만 엽니다.", ROOM_CONFIG, e)
+        return configs
+    if not isinstance(data, dict):
+        logger.error("방 설정 파일(%s)은 방 ID -> 설정 객체여야 합니다. 기본 방만 엽니다.", ROOM_CONFIG)
+        return configs
+    for room_id, config in data.items():
+        if room_id == DEFAULT_ROOM or not ROOM_ID_PATTERN.fullmatch(room_id) or not isinstance(config, dict):
+            logger.error("잘못된 방 ID 또는 설정 '%s'. 건너뜁니다.", room_id)
+            continue
+        calendar_ids = config.get("calendars", {})
+        if not isinstance(calendar_ids, dict) or set(calendar_ids) != set(SLOT_FLOORS):
+            logger.error("방 '%s'의 calendars에는 %s 층이 모두 있어야 합니다. 건너뜁니다.", room_id, list(SLOT_FLOORS))
+            continue
+        members = config.get("members")
+        if members is None and config.get("names_file"):
+            try:
+                with open(config["names_file"], 'r', encoding='utf-8') as f:
+                    members = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error("방 '%s'의 names_file을 읽을 수 없습니다: %s. 건너뜁니다.", room_id, e)
+                continue
+        if not isinstance(members, dict | None):
+            logger.error("방 '%s'의 members는 이름 -> 이니셜 객체여야 합니다. 건너뜁니다.", room_id)
+            continue
+        configs[room_id] = {"members": members or {}, "calendar_ids": calendar_ids, "admin": config.get("admin")}
+    logger.info("방 설정 로드 완료: %s", list(configs))
+    return configs
+
+class Room:
+    def __init__(self, room_id: str, members: dict[str, str], calendar_ids: dict[str, str], admin: str | None):
+        self.room_id = room_id
+        self.members = members
+        self.calendar_ids = calendar_ids
+        self.admin = admin
+        self.store = create_store(room_id)
+        # 이 워커(프로세스)에 직접 붙어 있는 이 방의 WebSocket 연결. 상태 자체는 store에 있다.
+        self.connections: dict[str, dict[str, Any]] = {}
+        self.mirror = CalendarMirror(self)
+        self.writer = CalendarWriter(self)
+        self.frames = StateFrameCache(members)
+        # 이 워커에서 시작한 라운드의 시작 시각 (라운드 시간 메트릭용)
+        self.round_started_at: float | None = None
+        self.last_active = time.monotonic()
+        # 현재 턴(또는 선호 목록 제출 기간)의 제한 시간 타이머
+        self.turn_timer: asyncio.Task | None = None
+        # 상태를 바꾸는 명령은 모두 이 큐를 거쳐 writer task 하나가 적용한다.
+        self.commands: asyncio.Queue[tuple[str, dict, asyncio.Future]] = asyncio.Queue(maxsize=COMMAND_QUEUE_SIZE)
+        self.writer_task: asyncio.Task | None = None
+
+    async def run_commands(self):
+        while True:
+            batch = [await self.commands.get()]
+            while len(batch) < COMMAND_BATCH_SIZE and not self.commands.empty():
+                batch.append(self.commands.get_nowait())
+            COMMAND_BATCH_SIZES.observe(len(batch))
+            try:
+                await apply_commands(self, batch)
+            except asyncio.CancelledError:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(CommandError("방이 닫혔습니다."))
+                raise
+            except Exception as e:
+                # 명령 결과는 apply_commands가 이미 돌려주었다. 여기까지 오는 것은 전달 단계의 오류다.
+                logger.exception("명령 처리 후 전달 실패 (방: %s): %s", self.room_id, e)
+
+    def arm_turn_timer(self):
+        # 턴이 바뀔 때마다 이전 타이머를 버리고 새 턴의 타이머를 건다.
+        if self.turn_timer:
+            self.turn_timer.cancel()
+        self.turn_timer = None
+        state = self.store.read()
+        if state.turn_timeout > 0 and state.round_open():
+            self.turn_timer = asyncio.create_task(self._expire_turn(state.current_turn_index, state.turn_timeout))
+
+    async def _expire_turn(self, index: int, timeout: float):
+        await asyncio.sleep(timeout)
+        try:
+            if self.store.read().round_mode == "preferences":
+                logger.info("선호 목록 제출 시간 종료. 배정을 시작합니다. (방: %s)", self.room_id)
+                await allocate_preferences(self)
+            else:
+                logger.info("%d번째 턴 시간 초과. (방: %s)", index + 1, self.room_id)
+                await run_command(self, "skip_turn", by="timer", index=index)
+        except CommandError:
+            pass
+
+    async def start(self):
+        self.writer_task = asyncio.create_task(self.run_commands())
+        await self.store.start(
+            lambda messages: deliver_local(self, messages),
+            lambda name, **kwargs: run_command(self, name, **kwargs),
+            self.writer.notify,
+            self.arm_turn_timer
+        )
+        # 재시작 후 저널에서 복구한 라운드가 진행 중이면 타이머를 다시 건다.
+        self.arm_turn_timer()
+        self.mirror.start()
+        self.writer.start()
+
+    async def stop(self):
+        if self.turn_timer:
+            self.turn_timer.cancel()
+        self.mirror.stop()
+        self.writer.stop()
+        if self.writer_task:
+            self.writer_task.cancel()
+        while not self.commands.empty():
+            _, _, future = self.commands.get_nowait()
+            if not future.done():
+                future.set_exception(CommandError("방이 닫혔습니다."))
+        await self.store.stop()
+
+    def evictable(self, now: float):
+        # 저장소에서 다시 복구할 수 없는 방(저널 없는 메모리 저장소)은 내리지 않는다.
+        return (
+            not self.connections and self.store.durable and self.commands.empty()
+            and (self.turn_timer is None or self.turn_timer.done())
+            and now - self.last_active >= ROOM_IDLE_TIMEOUT
+            and not self.writer.busy
+        )
+
+room_configs = load_room_configs()
+rooms: dict[str, Room] = {}
+
+async def get_room(room_id: str) -> Room | None:
+    room = rooms.get(room_id)
+    if room is None:
+        config = room_configs.get(room_id)
+        if config is None:
+            return None
+        room = rooms[room_id] = Room(room_id, **config)
+        logger.info("방 '%s' 로드.", room_id)
+        await room.start()
+    room.last_active = time.monotonic()
+    return room
+
+async def require_room(room_id: str) -> Room:
+    room = await get_room(room_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail="존재하지 않는 방입니다.")
+    return room
+
+async def run_room_reaper():
+    while True:
+        await asyncio.sleep(max(ROOM_IDLE_TIMEOUT / 4, 1))
+        now = time.monotonic()
+        for room_id, room in list(rooms.items()):
+            if room.evictable(now):
+                del rooms[room_id]
+                await room.stop()
+                logger.info("방 '%s' 메모리에서 내림 (%.0f초 동안 접속 없음).", room_id, now - room.last_active)
+
+CONNECTED_CLIENTS = Gauge(
+    "scheduler_connected_clients", "이 워커에 접속한 WebSocket 클라이언트 수",
+    lambda: sum(len(room.connections) for room in rooms.values()))
+LOADED_ROOMS = Gauge("scheduler_rooms_loaded", "메모리에 올라와 있는 방 수", lambda: len(rooms))
+COMMAND_QUEUE_DEPTH = Gauge(
+    "scheduler_command_queue_depth", "모든 방의 명령 큐에서 대기 중인 명령 수",
+    lambda: sum(room.commands.qsize() for room in rooms.values()))
+
+async def run_heartbeat():
+    # 모든 연결에 ping을 보내고, WS_IDLE_TIMEOUT 동안 아무 응답이 없는 연결(끊긴 Wi-Fi 등)은 정리한다.
+    ping = encode_json({"type": "ping"})
+    while True:
+        await asyncio.sleep(WS_PING_INTERVAL)
+        now = time.monotonic()
+        for room in list(rooms.values()):
+            for user_data in list(room.connections.values()):
+                channel = user_data["channel"]
+                if WS_IDLE_TIMEOUT > 0 and now - channel.last_seen > WS_IDLE_TIMEOUT:
+                    BROADCAST_FAILURES.inc(reason="heartbeat")
+                    channel.evict(f"하트비트 응답 없음 ({WS_IDLE_TIMEOUT}s)", 1001, "Heartbeat timeout")
+                else:
+                    channel.send(ping, "ping")
+
+room_reaper_task = None
+heartbeat_task = None
+
+@app.on_event("startup")
+async def start_rooms():
+    global room_reaper_task, heartbeat_task
+    await get_room(DEFAULT_ROOM)
+    if ROOM_IDLE_TIMEOUT > 0:
+        room_reaper_task = asyncio.create_task(run_room_reaper())
+    if WS_PING_INTERVAL > 0:
+        heartbeat_task = asyncio.create_task(run_heartbeat())
+
+@app.on_event("shutdown")
+async def stop_rooms():
+    if heartbeat_task:
+        heartbeat_task.cancel()
+    if room_reaper_task:
+        room_reaper_task.cancel()
+    for room in list(rooms.values()):
+        await room.stop()
+    rooms.clear()
+
+# --- 정적 파일 ---
+# brotli가 설치되어 있으면 br 압축본도 만든다. 없으면 gzip만.
+try:
+    import brotli
+
+    def compress_br(data: bytes) -> bytes | None:
+        return brotli.compress(data, quality=11)
+except ImportError:
+    def compress_br(data: bytes) -> bytes | None:
+        return None
+
+class StaticAsset:
+    # 파일을 메모리에 올려 두고 압축본과 ETag를 미리 만들어 둔다. 파일이 바뀌면(mtime/크기) 다시 읽는다.
+    # gzip-9/brotli-11 압축은 수십 ms가 걸려 워커 스레드에서 만들고, 그동안 다른 요청은 기존 본문을 그대로 받는다.
+    def __init__(self, path: str, media_type: str, fallback: str):
+        self.path = path
+        self.media_type = media_type
+        self.fallback = fallback.encode("utf-8")
+        self.signature = None
+        self.etag = ""
+        # Content-Encoding("identity", "gzip", "br") -> 본문
+        self.variants: dict[str, bytes] = {}
+        self.lock = asyncio.Lock()
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _build(self, signature) -> dict[str, bytes]:
+        # 워커 스레드에서 실행.
+        if signature is None:
+            data = self.fallback
+        else:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        variants = {"identity": data, "gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        br = compress_br(data)
+        if br is not None:
+            variants["br"] = br
+        return variants
+
+    async def load(self):
+        signature = self._signature()
+        if signature == self.signature and self.variants:
+            return
+        if self.variants and self.lock.locked():
+            # 다른 요청이 이미 다시 만드는 중이다.
+            return
+        async with self.lock:
+            signature = self._signature()
+            if signature == self.signature and self.variants:
+                return
+            variants = await asyncio.to_thread(self._build, signature)
+            self.signature = signature
+            self.etag = '"' + hashlib.sha1(variants["identity"]).hexdigest()[:20] + '"'
+            self.variants = variants
+        logger.info("정적 파일 로드: %s (%d bytes, %s)", self.path, len(variants["identity"]), ", ".join(
+            f"{encoding} {len(body)}" for encoding, body in variants.items() if encoding != "identity"
+        ))
+
+    async def response(self, request: HTTPRequest) -> Response:
+        await self.load()
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match", "")
+        if self.etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers=headers)
+        accepted = {part.split(";")[0].strip() for part in request.headers.get("accept-encoding", "").split(",")}
+        encoding = next((encoding for encoding in ("br", "gzip") if encoding in accepted and encoding in self.variants), "identity")
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+index_page = StaticAsset(
+    "index.html", "text/html; charset=utf-8",
+    "<html><body><h1>index.html 파일을 찾을 수 없습니다.</h1></body></html>",
+)
+
+@app.on_event("startup")
+async def preload_static_assets():
+    # 첫 요청이 압축을 기다리지 않도록 서버가 뜰 때 미리 만든다.
+    await index_page.load()
+
+# --- HTTP Routes ---
+@app.get("/")
+@app.get("/rooms/{room_id}/")
+async def get_root(request: HTTPRequest, room_id: str = DEFAULT_ROOM):
+    if room_id not in room_configs:
+        raise HTTPException(status_code=404, detail="존재하지 않는 방입니다.")
+    return await index_page.response(request)
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/get_names")
-async def get_names():
-    return {"names": list(name_map.keys())}
+@app.get("/rooms/{room_id}/get_names")
+async def get_names(room_id: str = DEFAULT_ROOM):
+    room = await require_room(room_id)
+    return {"names": list(room.members.keys()), "admin": room.admin}
+
+@app.get("/available_slots")
+@app.get("/rooms/{room_id}/available_slots")
+async def available_slots(floor: str | None = None, room_id: str = DEFAULT_ROOM):
+    if floor is not None and floor not in FLOOR_MASKS:
+        raise HTTPException(status_code=400, detail="Invalid floor")
+    room = await require_room(room_id)
+    state = room.store.read()
+    weeks = target_weeks(state)
+    free = ALL_SLOTS_MASK & ~(state.occupied | room.mirror.span_mask(weeks))
+    if floor is not None:
+        free &= FLOOR_MASKS[floor]
+    return {"week_start": weeks[0].isoformat(), "weeks": len(weeks), "slots": slot_ids_in_mask(free)}
 
 @app.post("/reset_session")
-async def reset_session():
-    global confirmed_reserved_slots, current_round_selections, turn_order, current_turn_index
-    print("[Admin] 시스템 상태 초기화...")
-    confirmed_reserved_slots = {}
-    current_round_selections = {}
-    turn_order = []
-    current_turn_index = 0
-    await broadcast_initial_state()
-    await notify_turn()
+@app.post("/rooms/{room_id}/reset_session")
+async def reset_session(room_id: str = DEFAULT_ROOM):
+    room = await require_room(room_id)
+    logger.info("[Admin] 시스템 상태 초기화... (방: %s)", room_id)
+    await run_command(room, "reset")
     return {"status": "success", "message": "시스템이 초기화되었습니다."}
 
 @app.post("/set_week_mode/{mode}")
-async def set_week_mode(mode: int):
-    global week_mode
-    if mode in [0, 1, 2]:
-        week_mode = mode
-        print(f"[Admin] 주간 모드 변경 -> {mode}")
-        await broadcast(json.dumps({"type": "week_mode_update", "mode": week_mode}))
-        return {"status": "success", "week_mode": week_mode}
-    raise HTTPException(status_code=400, detail="Invalid mode")
+@app.post("/rooms/{room_id}/set_week_mode/{mode}")
+async def set_week_mode(mode: int, weeks: int = 1, room_id: str = DEFAULT_ROOM):
+    # weeks: mode의 주부터 연속으로 예약할 주 수
+    room = await require_room(room_id)
+    if mode not in [0, 1, 2]:
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    if not 1 <= weeks <= BOOKING_MAX_WEEKS:
+        raise HTTPException(status_code=400, detail="Invalid weeks")
+    await run_command(room, "set_week_mode", mode=mode, weeks=weeks)
+    logger.info("[Admin] 주간 모드 변경 -> %s, %d주 (방: %s)", mode, weeks, room_id)
+    await room.mirror.seed_board()
+    return {"status": "success", "week_mode": mode, "weeks": weeks}
 
 class ManualAddRequest(BaseModel):
     name: str
@@ -231,264 +2350,419 @@ class ManualAddRequest(BaseModel):
     floor: str
 
 @app.post("/admin/manual_add")
-async def manual_add(item: ManualAddRequest):
-    global confirmed_reserved_slots
+@app.post("/rooms/{room_id}/admin/manual_add")
+async def manual_add(item: ManualAddRequest, room_id: str = DEFAULT_ROOM):
+    room = await require_room(room_id)
     slot_id = f"{item.day}-{item.time}-{item.floor}"
-    print(f"[Admin] 수동 추가 시도: {slot_id} / {item.name}")
+    logger.info("[Admin] 수동 추가 시도: %s / %s (방: %s)", slot_id, item.name, room_id)
+    if slot_id not in SLOT_INDEX:
+        raise HTTPException(status_code=400, detail="잘못된 슬롯입니다.")
 
-    if slot_id in confirmed_reserved_slots or slot_id in current_round_selections:
-        print(" > 에러: 중복된 슬롯")
+    try:
+        await ensure_calendar_service()
+    except Exception as e:
+        logger.error(" > 수동 추가 실패: %s", e)
+        raise HTTPException(status_code=500, detail=f"수동 추가 실패: {e}")
+
+    # 먼저 명령으로 슬롯을 대기로 잡고(쓰기 대기열에 넣고) 캘린더에 쓴 뒤, 결과에 따라 확정하거나 되돌린다.
+    # 확인과 쓰기 사이에 같은 슬롯이 다른 요청에 선택되는 일이 없다.
+    state = await room.store.refresh()
+    if room.mirror.span_mask(target_weeks(state)) >> SLOT_INDEX[slot_id] & 1:
+        logger.warning(" > 에러: 중복된 슬롯")
+        raise HTTPException(status_code=400, detail="이미 선택되거나 확정된 슬롯입니다.")
+    initial = room.members.get(item.name, "??")
+    week_start = target_week_start(state.week_mode)
+    claimed = await run_command(room, "claim_calendar_writes", items={slot_id: {
+        "user": item.name, "initial": initial, "week_start": week_start.isoformat(), "weeks": state.week_count
+    }})
+    if not claimed:
+        logger.warning(" > 에러: 중복된 슬롯")
         raise HTTPException(status_code=400, detail="이미 선택되거나 확정된 슬롯입니다.")
-    
+
     try:
-        if not calendar_service.service or (calendar_service.credentials and not calendar_service.credentials.valid):
-            calendar_service.build_service()
-        
-        start_iso, end_iso = get_event_datetime(item.day, item.time, week_mode)
-        initial = name_map.get(item.name, "??")
-        calendar_id = CALENDAR_IDS.get(item.floor)
-        
-        if not calendar_id:
-            raise ValueError("Invalid floor")
-        
-        event = calendar_service.insert_event(
-            calendar_id=calendar_id, event_name=initial,
-            start=start_iso, end=end_iso, description=slot_id
+        [result] = await write_calendar_items(
+            room, [calendar_write_item(room, slot_id, initial, week_start, state.week_count)]
         )
-        if not event:
-            raise Exception("Calendar API returned None")
-        
-        confirmed_reserved_slots[slot_id] = initial
-        print(f" > 성공. 캘린더 추가 완료.")
-        await broadcast_initial_state()
-        return {"status": "success", "slot_id": slot_id, "initial": initial}
     except Exception as e:
-        print(f" > 수동 추가 실패: {e}")
-        raise HTTPException(status_code=500, detail=f"수동 추가 실패: {e}")
+        logger.warning(" > 캘린더 쓰기 실패, 대기열에서 다시 시도합니다: %s", e)
+        result = "retry"
+    if result == "retry":
+        # 슬롯은 대기로 남고 CalendarWriter가 이어서 쓴다.
+        room.writer.notify()
+        return {"status": "queued", "slot_id": slot_id, "initial": initial}
+    written = {slot_id: initial} if result == "written" else {}
+    await run_command(room, "finish_calendar_writes", written=written, failed=[] if written else [slot_id])
+    if not written:
+        logger.warning(" > 에러: 캘린더에 다른 일정이 있음")
+        raise HTTPException(status_code=400, detail="캘린더에 다른 일정이 있어 추가하지 못했습니다.")
+    logger.info(" > 성공. 캘린더 추가 완료.")
+    return {"status": "success", "slot_id": slot_id, "initial": initial}
+
+class BulkAddRow(BaseModel):
+    name: str
+    day: str
+    time: str
+    floor: str
+    # 주: 정수면 이번 주로부터 몇 주 뒤(week_mode와 같은 기준), 문자열이면 그 주에 속한 날짜(YYYY-MM-DD). 없으면 현재 주간 모드.
+    week: int | str | None = None
+    # 그 주부터 매주 반복할 횟수
+    weeks: int = 1
+
+def parse_bulk_rows(body: bytes, content_type: str) -> list[dict]:
+    # JSON 목록({"rows": [...]} 또는 [...]) 또는 헤더가 있는 CSV(name,day,time,floor[,week,weeks])
+    if "csv" in content_type:
+        rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+        for row in rows:
+            for field in ("week", "weeks"):
+                value = (row.get(field) or "").strip()
+                if not value:
+                    row.pop(field, None)
+                elif value.lstrip("-").isdigit():
+                    row[field] = int(value)
+        return rows
+    data = json.loads(body)
+    rows = data.get("rows") if isinstance(data, dict) else data
+    if not isinstance(rows, list):
+        raise ValueError("rows 목록이 필요합니다.")
+    return rows
+
+def bulk_row_week(row: BulkAddRow, state: SchedulerState) -> datetime.date:
+    if row.week is None:
+        return target_week_start(state.week_mode)
+    if isinstance(row.week, int):
+        if not 0 <= row.week <= BOOKING_MAX_WEEKS:
+            raise ValueError(f"week는 0~{BOOKING_MAX_WEEKS} 사이여야 합니다.")
+        return target_week_start(row.week)
+    day = datetime.date.fromisoformat(row.week)
+    week_start = day - datetime.timedelta(days=day.weekday())
+    # 날짜도 주 번호와 같은 범위: 이번 주부터 BOOKING_MAX_WEEKS주 뒤까지만 받는다.
+    if week_start < target_week_start(0):
+        raise ValueError("지난 주에는 예약할 수 없습니다.")
+    if week_start > target_week_start(BOOKING_MAX_WEEKS):
+        raise ValueError(f"{BOOKING_MAX_WEEKS}주 뒤까지만 예약할 수 있습니다.")
+    return week_start
+
+@app.post("/admin/bulk_add")
+@app.post("/rooms/{room_id}/admin/bulk_add")
+async def bulk_add(request: HTTPRequest, room_id: str = DEFAULT_ROOM):
+    # 여러 행을 한 번에 검증하고, 유효한 행만 캘린더별 배치 요청으로 넣는다. 보드 갱신은 잡을 때와 확정할 때 한 번씩만 브로드캐스트한다.
+    # 이벤트 ID가 (주, 슬롯)으로 정해져 있어 같은 파일을 다시 올려도 일정이 두 번 생기지 않는다.
+    room = await require_room(room_id)
+    try:
+        raw_rows = parse_bulk_rows(await request.body(), request.headers.get("content-type", ""))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"입력 형식 오류: {e}")
+    if len(raw_rows) > BULK_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"한 번에 최대 {BULK_IMPORT_MAX_ROWS}행까지 넣을 수 있습니다.")
+
+    state = await room.store.refresh()
+    board_weeks = set(target_weeks(state))
+    errors: list[dict[str, Any]] = []
+    # (행 번호, 이름, slot_id, 이니셜, 주 시작일, 반복 주 수, 보드가 가리키는 주에 걸치는지)
+    valid: list[tuple[int, str, str, str, datetime.date, int, bool]] = []
+    # 주 -> 이 요청에서 이미 받은 슬롯 비트마스크 (행끼리의 중복 검사)
+    requested: dict[datetime.date, int] = {}
+    # 보드가 가리키는 주에 걸친 행이 받은 슬롯. 보드에는 슬롯마다 한 칸뿐이라 주가 달라도 한 행만 받는다.
+    board_requested = 0
+    for number, raw in enumerate(raw_rows, start=1):
+        try:
+            row = BulkAddRow.model_validate(raw)
+            week_start = bulk_row_week(row, state)
+        except ValidationError as e:
+            fields = ", ".join(".".join(map(str, error["loc"])) or "row" for error in e.errors())
+            errors.append({"row": number, "error": f"형식 오류: {fields}"})
+            continue
+        except (ValueError, OverflowError) as e:
+            errors.append({"row": number, "error": f"형식 오류: {e}"})
+            continue
+        slot_id = f"{row.day}-{row.time}-{row.floor}"
+        if row.name not in room.members:
+            errors.append({"row": number, "error": f"알 수 없는 이름: {row.name}"})
+            continue
+        if slot_id not in SLOT_INDEX:
+            errors.append({"row": number, "error": f"잘못된 슬롯: {slot_id}"})
+            continue
+        if not 1 <= row.weeks <= BOOKING_MAX_WEEKS:
+            errors.append({"row": number, "error": f"weeks는 1~{BOOKING_MAX_WEEKS} 사이여야 합니다."})
+            continue
+        bit = 1 << SLOT_INDEX[slot_id]
+        weeks = [week_start + datetime.timedelta(weeks=i) for i in range(row.weeks)]
+        on_board = bool(board_weeks.intersection(weeks))
+        if any(requested.get(week, 0) & bit for week in weeks) or (on_board and board_requested & bit):
+            errors.append({"row": number, "error": "같은 요청 안에서 중복된 슬롯입니다."})
+            continue
+        if room.mirror.span_mask(weeks) & bit or (on_board and state.occupied & bit):
+            errors.append({"row": number, "error": "이미 선택되거나 확정된 슬롯입니다."})
+            continue
+        for week in weeks:
+            requested[week] = requested.get(week, 0) | bit
+        if on_board:
+            board_requested |= bit
+        valid.append((number, row.name, slot_id, room.members[row.name], week_start, row.weeks, on_board))
+    logger.info("[Admin] 일괄 추가: %d행 중 %d행 유효 (방: %s)", len(raw_rows), len(valid), room_id)
+
+    added = []
+    queued = []
+    if valid:
+        try:
+            await ensure_calendar_service()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"일괄 추가 실패: {e}")
+        # 보드가 가리키는 주에 걸친 행은 먼저 명령으로 슬롯을 대기로 잡는다 (한 번의 state_delta).
+        # 그 사이 다른 요청이 잡은 슬롯은 쓰지 않고, 쓴 결과는 finish_calendar_writes로 확정하거나 되돌린다.
+        # 같은 슬롯이라도 다른 주의 행은 보드와 상관없으므로, 잡기/확정은 행 번호로 따진다.
+        board_rows = {
+            number: (slot_id, {"user": name, "initial": initial, "week_start": week_start.isoformat(), "weeks": weeks})
+            for number, name, slot_id, initial, week_start, weeks, on_board in valid if on_board
+        }
+        claimed_rows: set[int] = set()
+        if board_rows:
+            claimed = set(await run_command(
+                room, "claim_calendar_writes", items=dict(board_rows.values())
+            ))
+            claimed_rows = {number for number, (slot_id, _) in board_rows.items() if slot_id in claimed}
+        for number in board_rows.keys() - claimed_rows:
+            errors.append({"row": number, "error": "이미 선택되거나 확정된 슬롯입니다."})
+        valid = [row for row in valid if row[0] not in board_rows or row[0] in claimed_rows]
+
+        try:
+            results = await write_calendar_items(room, [
+                calendar_write_item(room, slot_id, initial, week_start, weeks)
+                for _, _, slot_id, initial, week_start, weeks, _ in valid
+            ])
+        except Exception as e:
+            # 잡아 둔 슬롯은 대기열에 남아 CalendarWriter가 이어서 쓴다.
+            room.writer.notify()
+            raise HTTPException(status_code=500, detail=f"일괄 추가 실패: {e}")
+        written: dict[str, str] = {}
+        failed: list[str] = []
+        for (number, _, slot_id, initial, *_), result in zip(valid, results):
+            if result == "written":
+                added.append((number, slot_id, initial))
+                if number in claimed_rows:
+                    written[slot_id] = initial
+            elif result == "failed":
+                errors.append({"row": number, "error": "캘린더에 다른 일정이 있어 추가하지 못했습니다."})
+                if number in claimed_rows:
+                    failed.append(slot_id)
+            elif number in claimed_rows:
+                # 보드에 대기로 남고 CalendarWriter가 이어서 쓴다.
+                queued.append((number, slot_id, initial))
+            else:
+                errors.append({"row": number, "error": "캘린더 API 일시 오류. 다시 올리면 이어서 추가됩니다."})
+        if written or failed:
+            await run_command(room, "finish_calendar_writes", written=written, failed=failed)
+        if queued:
+            room.writer.notify()
+
+    errors.sort(key=lambda error: error["row"])
+    return {
+        "status": "success" if not errors else "partial",
+        "added": [{"row": number, "slot_id": slot_id, "initial": initial} for number, slot_id, initial in sorted(added)],
+        "queued": [{"row": number, "slot_id": slot_id, "initial": initial} for number, slot_id, initial in sorted(queued)],
+        "errors": errors,
+    }
 
 @app.post("/start_round")
-async def start_round():
-    global turn_order, current_turn_index, current_round_selections
-    print("새 라운드 시작.")
-    current_round_selections = {}
-    
+@app.post("/rooms/{room_id}/start_round")
+async def start_round(mode: str = "turns", turn_timeout: float | None = None, room_id: str = DEFAULT_ROOM):
+    room = await require_room(room_id)
+    logger.info("새 라운드 시작. (방: %s)", room_id)
     participants = [
-        name for name, data in client_connections.items() 
+        name for name, data in (await room.store.refresh()).presence.items()
         if data.get("participating", True)
     ]
-    
-    if not participants:
-        print(" > 에러: 참여자가 없습니다.")
-        return {"status": "error", "message": "참여자로 설정된 사용자가 없습니다."}
-    
-    turn_order = random.sample(participants, len(participants)) 
-    current_turn_index = 0
-    print(f"새 라운드 순서 ({len(participants)}명): {turn_order}")
-    await broadcast_initial_state()
-    await broadcast(json.dumps({"type": "round_started", "order": turn_order}))
-    await notify_turn() 
+    try:
+        turn_order = random.sample(participants, len(participants))
+        await run_command(
+            room, "start_round", order=turn_order, mode=mode,
+            turn_timeout=TURN_TIMEOUT if turn_timeout is None else turn_timeout
+        )
+        room.round_started_at = time.monotonic()
+    except CommandError as e:
+        logger.warning(" > 에러: %s", e)
+        return {"status": "error", "message": str(e)}
     return {"status": "round started", "turn_order": turn_order}
 
+@app.post("/allocate_preferences")
+@app.post("/rooms/{room_id}/allocate_preferences")
+async def allocate_preferences_now(room_id: str = DEFAULT_ROOM):
+    # 제출 기간을 기다리지 않고 지금까지 낸 선호 목록으로 배정한다. 목록을 내지 않은 사람은 배정받지 못한다.
+    room = await require_room(room_id)
+    logger.info("[Admin] 선호 목록 배정 실행. (방: %s)", room_id)
+    try:
+        await allocate_preferences(room)
+    except CommandError as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "success"}
+
 @app.post("/commit_calendar")
-async def commit_calendar():
-    global confirmed_reserved_slots, current_round_selections, week_mode
-    if not current_round_selections:
-        return {"status": "error", "message": "새로 추가할 예약이 없습니다."}
-    
-    print(f"캘린더 일괄 추가 시작 (모드: {week_mode}). 대상: {current_round_selections}")
+@app.post("/rooms/{room_id}/commit_calendar")
+async def commit_calendar(room_id: str = DEFAULT_ROOM):
+    # 현재 선택을 캘린더 쓰기 대기열에 넣고 바로 돌아간다. 쓰기 결과는 calendar_committed로 브로드캐스트된다.
+    room = await require_room(room_id)
     try:
-        if not calendar_service.service or (calendar_service.credentials and not calendar_service.credentials.valid):
-            calendar_service.build_service()
-        
-        success_data = {}
-        for slot_id, user_name in current_round_selections.items():
-            parts = slot_id.split('-')
-            initial = name_map[user_name]
-            calendar_id = CALENDAR_IDS[parts[2]]
-            start_iso, end_iso = get_event_datetime(parts[0], parts[1], week_mode)
-            
-            event = calendar_service.insert_event(
-                calendar_id=calendar_id, event_name=initial,
-                start=start_iso, end=end_iso, description=slot_id
-            )
-            if event:
-                print(f"  > {slot_id} ({user_name}) 추가 성공.")
-                success_data[slot_id] = initial
-            else:
-                print(f"  > {slot_id} ({user_name}) 추가 실패.")
-        
-        confirmed_reserved_slots.update(success_data)
-        current_round_selections = {} 
-        await broadcast(json.dumps({
-            "type": "calendar_committed",
-            "committed_data": success_data
-        }))
-        return {"status": "success", "committed_count": len(success_data)}
+        # 처음 한 번은 여기서 로컬 인증 흐름이 열릴 수 있다. 실패해도 대기열은 남아 나중에 다시 쓴다.
+        await ensure_calendar_service()
     except Exception as e:
-        print(f"[캘린더 일괄 추가 에러] {e}")
-        raise HTTPException(status_code=500, detail=f"캘린더 일괄 추가 실패: {e}")
+        logger.warning("캘린더 서비스 준비 실패: %s", e)
+    state = room.store.read()
+    try:
+        # 이니셜은 명령 안에서 그 시점의 선택으로 고른다.
+        targets = await run_command(
+            room, "queue_calendar_writes",
+            week_start=target_week_start(state.week_mode).isoformat(), initials=room.members, weeks=state.week_count
+        )
+    except CommandError as e:
+        return {"status": "error", "message": str(e)}
+    logger.info("캘린더 일괄 추가 대기열에 추가 (모드: %s, %d주). 대상: %s", state.week_mode, state.week_count, targets)
+    room.writer.notify()
+    return {"status": "queued", "queued_count": len(targets)}
 
 # --- WebSocket ---
+WS_MESSAGE_TYPES = frozenset({
+    "admin_delete", "sync", "set_participation", "pass_turn", "admin_skip_turn", "submit_preferences", "chat", "pong"
+})
+
 @app.websocket("/ws/{user_name}")
-async def websocket_endpoint(websocket: WebSocket, user_name: str):
-    global current_turn_index
-    if user_name not in name_map:
+@app.websocket("/rooms/{room_id}/ws/{user_name}")
+async def websocket_endpoint(websocket: WebSocket, user_name: str, since: int | None = None, epoch: str | None = None,
+                             resume: str | None = None, room_id: str = DEFAULT_ROOM):
+    room = await get_room(room_id)
+    if room is None:
+        await websocket.close(code=1008, reason="Invalid room")
+        return
+    if user_name not in room.members:
         await websocket.close(code=1008, reason="Invalid user name")
         return
-    await websocket.accept()
-    
-    if user_name in client_connections:
-        print(f"'{user_name}' 님은 이미 접속 중입니다. 새 연결을 거부합니다.")
+    binary = WS_BINARY_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+    await websocket.accept(subprotocol=WS_BINARY_SUBPROTOCOL if binary else None)
+
+    # 이미 접속 중인 이름이면 세션 토큰(resume)이 맞을 때만 이전 연결을 대체한다.
+    # connect가 성공한 뒤에야 브로드캐스트 대상에 넣고, 이전 연결은 그 자리에서 한 번에 바꾼다 (사이에 await 없음).
+    # 거부된 연결은 room.connections를 건드리지 않는다.
+    channel = ClientChannel(websocket, user_name, room, binary)
+    token = secrets.token_urlsafe(16)
+    try:
+        await run_command(room, "connect", user_name=user_name, worker=WORKER_ID, conn=channel.conn_id,
+                          token=token, resume=resume)
+    except CommandError:
+        channel.stop()
+        channel = None
+    else:
+        previous = room.connections.get(user_name)
+        room.connections[user_name] = {"ws": websocket, "channel": channel}
+        if previous:
+            logger.info("'%s' 님이 세션을 이어받았습니다. 이전 연결을 닫습니다.", user_name)
+            previous["channel"].replace()
+    if channel is None:
+        logger.warning("'%s' 님은 이미 접속 중입니다. 새 연결을 거부합니다.", user_name)
         await websocket.send_text(json.dumps({
             "type": "error", "message": "이미 접속 중인 이름입니다."
         }))
         await websocket.close(code=1003, reason="Duplicate connection")
         return
 
-    client_connections[user_name] = {"ws": websocket, "participating": True}
-    print(f"클라이언트 '{user_name}' 접속. (총 {len(client_connections)} 명)")
-    await broadcast_user_list()
-    
-    initial_current_index = len(turn_order)
-    initial_current_user = "ROUND_END"
-    if turn_order and current_turn_index < len(turn_order):
-        initial_current_user = turn_order[current_turn_index]
-        initial_current_index = current_turn_index
-
-    await websocket.send_text(json.dumps({
-        "type": "initial_state",
-        "reserved": confirmed_reserved_slots,
-        "pending": {slot_id: name_map.get(name, "??") for slot_id, name in current_round_selections.items()},
-        "order": turn_order,
-        "current_turn": initial_current_user,
-        "current_index": initial_current_index
-    }))
-    await websocket.send_text(json.dumps({
-        "type": "turn_update",
-        "user": initial_current_user,
-        "order": turn_order,
-        "current_index": initial_current_index
-    }))
-    await websocket.send_text(json.dumps({"type": "week_mode_update", "mode": week_mode}))
+    channel.send(encode_json({"type": "session", "token": token}))
+    # connect가 보낸 접속자 목록은 등록 전이라 받지 못했다.
+    channel.send(encode_json(room.store.read().user_list_payload()))
+    missed = await room.store.messages_since(since, epoch) if since is not None else None
+    if missed is not None:
+        # 재접속: 놓친 변경분과 현재 턴/주간 모드만 보낸다.
+        for message in missed:
+            channel.send(message)
+        state = room.store.read()
+        channel.send(room.frames.get(state, "turn_update", channel.binary), "turn_update")
+        channel.send(room.frames.get(state, "week_mode_update", channel.binary))
+    else:
+        channel.send(room.frames.get(room.store.read(), "initial_state", channel.binary), "initial_state")
 
     try:
         while True:
             data = await websocket.receive_text()
+            channel.last_seen = time.monotonic()
+            started = time.perf_counter()
             try:
                 msg_data = json.loads(data)
-                msg_type = msg_data.get("type")
+            except json.JSONDecodeError:
+                msg_data = None
+            msg_type = msg_data.get("type") if isinstance(msg_data, dict) else None
+            # 클라이언트가 보낸 임의의 타입으로 라벨이 늘어나지 않도록 알려진 타입만 그대로 쓴다.
+            metric_type = msg_type if msg_type in WS_MESSAGE_TYPES else ("select_slot" if msg_data is None else "unknown")
+            try:
+                if msg_type == "pong":
+                    pass
 
-                if msg_type == "admin_delete" and user_name == '건우':
+                elif msg_type == "admin_delete" and user_name == room.admin:
                     slot_id = msg_data.get("slotId")
-                    if slot_id:
-                        print(f"[Admin] 슬롯 삭제 시도: {slot_id}")
-                        deleted_from_pending = current_round_selections.pop(slot_id, None)
-                        deleted_from_confirmed = confirmed_reserved_slots.pop(slot_id, None)
-                        if deleted_from_pending or deleted_from_confirmed:
-                            print(f" > 삭제 성공.")
-                            await broadcast_initial_state()
-                        else:
-                            print(f" > 삭제 실패: 존재하지 않는 슬롯.")
-                    continue
+                    if slot_id in SLOT_INDEX:
+                        logger.info("[Admin] 슬롯 삭제 시도: %s", slot_id)
+                        try:
+                            await run_command(room, "admin_delete", slot_id=slot_id)
+                            logger.info(" > 삭제 성공.")
+                        except CommandError:
+                            logger.warning(" > 삭제 실패: 존재하지 않는 슬롯.")
+
+                elif msg_type == "sync":
+                    # 버전 누락을 감지한 클라이언트가 since 이후의 변경분을 요청한다.
+                    await send_state_since(room, channel, msg_data.get("since"), msg_data.get("epoch"))
 
                 elif msg_type == "set_participation":
-                    status = msg_data.get("status", True)
-                    if user_name in client_connections:
-                        client_connections[user_name]["participating"] = status
-                        print(f"'{user_name}' 님 참여 상태 변경 -> {status}")
-                        await broadcast_user_list()
-                    continue
+                    await run_command(room, "set_participation", user_name=user_name, status=msg_data.get("status", True))
 
                 elif msg_type == "pass_turn":
-                    print(f"'{user_name}' 님 턴 넘기기 시도...")
-                    if not turn_order:
-                        await websocket.send_text(json.dumps({"type": "error", "message": "라운드가 아직 시작되지 않았습니다."}))
-                        continue
-                    if current_turn_index >= len(turn_order):
-                        await websocket.send_text(json.dumps({"type": "error", "message": "모든 턴이 종료되었습니다."}))
-                        continue
-                    current_user = turn_order[current_turn_index]
-                    if user_name != current_user:
-                        await websocket.send_text(json.dumps({"type": "error", "message": f"현재 {current_user} 님의 턴입니다."}))
-                        continue
-                    
-                    print(f" > '{user_name}' 님이 턴을 넘겼습니다.")
-                    await broadcast(json.dumps({"type": "turn_passed", "user": user_name}))
-                    current_turn_index += 1
-                    await notify_turn()
-                    continue
+                    logger.info("'%s' 님 턴 넘기기 시도...", user_name)
+                    await run_command(room, "pass_turn", user_name=user_name)
 
-                elif msg_type == "admin_skip_turn" and user_name == '건우':
-                    print("[Admin] 턴 강제 스킵 시도...")
-                    if not turn_order:
-                        await websocket.send_text(json.dumps({"type": "error", "message": "라운드가 아직 시작되지 않았습니다."}))
-                        continue
-                    if current_turn_index >= len(turn_order):
-                        await websocket.send_text(json.dumps({"type": "error", "message": "모든 턴이 종료되었습니다."}))
-                        continue
-                    skipped_user = turn_order[current_turn_index]
-                    print(f" > [Admin] {skipped_user} 님의 턴을 스킵했습니다.")
-                    current_turn_index += 1
-                    await broadcast(json.dumps({
-                        "type": "turn_skipped",
-                        "skipped_user": skipped_user,
-                        "by": user_name
-                    }))
-                    await notify_turn()
-                    continue
+                elif msg_type == "admin_skip_turn" and user_name == room.admin:
+                    logger.info("[Admin] 턴 강제 스킵 시도...")
+                    await run_command(room, "skip_turn", by=user_name)
+
+                elif msg_type == "submit_preferences":
+                    if await run_command(room, "submit_preferences", user_name=user_name, slots=msg_data.get("slots")):
+                        await allocate_preferences(room)
 
                 elif msg_type == "chat":
                     message_text = msg_data.get("message")
                     if message_text:
-                        print(f"[Chat] {user_name}: {message_text}")
-                        await broadcast(json.dumps({
+                        logger.info("[Chat] %s: %s", user_name, message_text)
+                        await broadcast(room, encode_json({
                             "type": "chat_message",
                             "user": user_name,
                             "message": message_text
                         }))
-                    continue
 
-            except json.JSONDecodeError:
-                pass 
-            
-            # 일반 예약 로직
-            if not turn_order:
-                await websocket.send_text(json.dumps({"type": "error", "message": "라운드가 아직 시작되지 않았습니다."}))
-                continue
-            if current_turn_index >= len(turn_order):
-                await websocket.send_text(json.dumps({"type": "error", "message": "모든 턴이 종료되었습니다."}))
-                continue
-            current_user = turn_order[current_turn_index]
-            if user_name != current_user:
-                await websocket.send_text(json.dumps({"type": "error", "message": f"현재 {current_user} 님의 턴입니다."}))
-                continue
-            
-            if data in confirmed_reserved_slots or data in current_round_selections:
-                await websocket.send_text(json.dumps({"type": "error", "message": "이미 선택된 슬롯입니다."}))
-                continue
+                elif msg_data is None:
+                    # 일반 예약 로직. 형식이 틀린 슬롯은 상태를 건드리기 전에 거른다.
+                    slot_index = SLOT_INDEX.get(data)
+                    if slot_index is None:
+                        raise CommandError("잘못된 슬롯입니다.")
+                    if room.mirror.span_mask(target_weeks(room.store.read())) >> slot_index & 1:
+                        raise CommandError("이미 캘린더에 예약된 슬롯입니다.")
+                    await run_command(room, "select_slot", user_name=user_name, slot_id=data, initial=room.members.get(user_name, "??"))
+
+            except CommandError as e:
+                WS_MESSAGE_ERRORS.inc(type=metric_type)
+                channel.send(encode_json({"type": "error", "message": str(e)}))
+            WS_MESSAGE_SECONDS.observe(time.perf_counter() - started, type=metric_type)
 
-            print(f"'{user_name}' 님이 '{data}' 슬롯 선택 (버퍼에 추가)")
-            current_round_selections[data] = user_name
-            await broadcast(json.dumps({
-                "type": "slot_update", 
-                "slotId": data,
-                "user": user_name,
-                "initial": name_map.get(user_name, '??')
-            }))
-            
-            current_turn_index += 1
-            await notify_turn()
-            
     except WebSocketDisconnect:
         pass
     except Exception as e:
-        print(f"에러 발생 (user: {user_name}): {e}")
+        logger.exception("에러 발생 (user: %s): %s", user_name, e)
     finally:
-        if user_name in client_connections:
-            del client_connections[user_name]
-            print(f"클라이언트 '{user_name}' 접속 해제. (남은 인원 {len(client_connections)} 명)")
-            await broadcast_user_list()
+        channel.stop()
+        if room.connections.get(user_name, {}).get("channel") is channel:
+            del room.connections[user_name]
+            await run_command(room, "disconnect", user_name=user_name, conn=channel.conn_id)
 
 if __name__ == "__main__":
-    print("서버 시작... http://127.0.0.1:8000")
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    logger.info("서버 시작... http://127.0.0.1:8000")
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    if workers > 1 and STATE_BACKEND != "sqlite":
+        logger.warning("여러 워커로 실행하려면 STATE_BACKEND=sqlite 가 필요합니다. 단일 워커로 실행합니다.")
+        workers = 1
+    if workers > 1:
+        uvicorn.run("main:app", host="127.0.0.1", port=8000, workers=workers)
+    else:
+        uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,55 @@
+# 바이너리(msgpack) 인코더 왕복 점검: encode_binary_payload로 만든 프레임을 msgpack으로 풀고 슬롯 번호를
+# 슬롯 ID로 되돌려 원래 메시지와 같은지 확인한다. 서버 쪽 인코딩(슬롯 번호 치환 포함)만 확인하며,
+# index.html의 decodeMsgpack / expandSlotCodes를 실행하지는 않는다.
+#
+#   python wirecheck.py
+import os
+import sys
+
+import msgpack
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main
+
+SAMPLES = [
+    {"type": "initial_state", "version": 3, "epoch": "ab12cd34", "reserved": {"Mon-AM-1F": "KW"},
+     "pending": {"Tue-NT-3F": "GM"}, "order": ["건우", "구민"], "current_turn": "건우", "current_index": 0,
+     "week_mode": 1, "week_count": 4, "round_mode": "turns", "turn_timeout": 30.5},
+    {"type": "slot_update", "slotId": "Sun-PM-3F", "user": "건우", "initial": "KW", "version": 70000},
+    {"type": "state_delta", "removed": ["Mon-AM-1F", "Wed-PM-1F"], "pending": {}, "version": 4},
+    {"type": "calendar_committed", "committed_data": {"Fri-AM-1F": "KW"}, "removed": [], "version": 5},
+    {"type": "turn_update", "user": "ROUND_END", "order": [], "current_index": -1, "timeout": 0.0},
+    {"type": "chat_message", "user": "구민", "message": "가" * 300, "big": 1 << 40, "neg": -(1 << 40), "none": None,
+     "flags": [True, False], "nested": {str(i): i for i in range(20)}},
+]
+
+def expand_slot_codes(message: dict, slot_codes: list[str]):
+    slot_of = lambda code: slot_codes[code] if isinstance(code, int) else code
+    for field in main.SLOT_KEY_FIELDS:
+        if field in message:
+            message[field] = {slot_of(code): value for code, value in message[field].items()}
+    for field in main.SLOT_LIST_FIELDS:
+        if field in message:
+            message[field] = [slot_of(code) for code in message[field]]
+    if "slotId" in message:
+        message["slotId"] = slot_of(message["slotId"])
+    message.pop("slots", None)
+    return message
+
+def main_check():
+    failures = 0
+    for sample in SAMPLES:
+        # 슬롯 번호가 맵의 키로 들어가므로 정수 키를 허용한다.
+        decoded = msgpack.unpackb(main.encode_binary_payload(sample), strict_map_key=False)
+        if sample["type"] == "initial_state" and decoded.get("slots") != list(main.SLOT_IDS):
+            print(f"{sample['type']}: 슬롯 번호표가 다릅니다.")
+            failures += 1
+        decoded = expand_slot_codes(decoded, list(main.SLOT_IDS))
+        if decoded != sample:
+            print(f"{sample['type']}: 되돌린 메시지가 다릅니다.\n  원본: {sample}\n  결과: {decoded}")
+            failures += 1
+    print(f"{len(SAMPLES) - failures}/{len(SAMPLES)} 통과")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main_check()